@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AmazonCloneConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "amazon_clone"
+
+    def ready(self):
+        from . import signals  # noqa: F401
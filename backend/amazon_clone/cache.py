@@ -0,0 +1,138 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+from rest_framework.utils.serializer_helpers import ReturnDict, ReturnList
+
+
+VERSION_KEY_PREFIX = 'catalog:version:'
+RESPONSE_KEY_PREFIX = 'catalog:response:'
+
+# Version scopes. A version is the time (in nanoseconds) the scope last
+# changed, so it doubles as its Last-Modified date. CATALOG is part of
+# every key and is bumped by bulk operations that bypass model signals.
+CATALOG = 'catalog'
+PRODUCTS = 'products'
+CATEGORIES = 'categories'
+
+
+def product_scope(product_id):
+    return f'product:{product_id}'
+
+
+def version_timeout():
+    # A per-process cache only sees this process's bumps, so versions are
+    # restarted every CATALOG_CACHE_TIMEOUT to pick up other processes' changes
+    return None if settings.CATALOG_CACHE_SHARED else settings.CATALOG_CACHE_TIMEOUT
+
+
+def get_catalog_versions(scopes):
+    """Current version of each scope, starting missing ones at the current time"""
+    keys = [VERSION_KEY_PREFIX + scope for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Starting at the current time keeps versions unique even after an eviction
+            version = time.time_ns()
+            cache.add(key, version, version_timeout())
+            versions[key] = cache.get(key, version)
+    return [versions[key] for key in keys]
+
+
+def bump_catalog_versions(*scopes):
+    """Invalidate every cached response that depends on one of these scopes"""
+    now = time.time_ns()
+    for scope in scopes:
+        key = VERSION_KEY_PREFIX + scope
+        previous = cache.get(key)
+        version = now if previous is None or previous < now else previous + 1
+        cache.set(key, version, version_timeout())
+
+
+def bump_catalog_versions_on_commit(*scopes):
+    """
+    bump_catalog_versions() once the current transaction commits.
+
+    Bumping earlier would let a concurrent request cache the rows as they
+    were before the commit under the new version.
+    """
+    transaction.on_commit(lambda: bump_catalog_versions(*scopes))
+
+
+def normalized_query(request):
+    """Query string with empty values dropped and parameters sorted"""
+    params = []
+    for name, values in sorted(request.query_params.lists()):
+        params.extend((name, value) for value in sorted(values) if value != '')
+    return '&'.join(f'{name}={value}' for name, value in params)
+
+
+def plain_data(data):
+    """Copy serializer output into plain lists and dicts that can be pickled"""
+    if isinstance(data, (dict, ReturnDict)):
+        return {key: plain_data(value) for key, value in data.items()}
+    if isinstance(data, (list, ReturnList)):
+        return [plain_data(value) for value in data]
+    return data
+
+
+def cached_catalog_response(request, scopes, build_response, last_modified=None):
+    """
+    Serve a catalog GET with conditional request support and a shared cache.
+
+    The strong ETag is derived from the scope versions, the normalized URL,
+    the Accept header and the user, and Last-Modified from the
+    newest scope version and the optional `last_modified` callable (an
+    `updated_at` lookup). Matching If-None-Match / If-Modified-Since
+    headers are answered with 304 before any serializer runs.
+
+    Only anonymous requests read or fill the response cache, so a seller's
+    view of their own unapproved products is never stored or served to the
+    public.
+    """
+    if request.method != 'GET':
+        return build_response()
+
+    versions = get_catalog_versions([CATALOG, *scopes])
+    url = f'{request.path}?{normalized_query(request)}'
+    user = request.user.pk if request.user.is_authenticated else 'anonymous'
+    accept = request.META.get('HTTP_ACCEPT', '')
+    etag = quote_etag(hashlib.md5(
+        f'{".".join(map(str, versions))}|{url}|{accept}|{user}'.encode('utf-8')
+    ).hexdigest())
+
+    modified = max(versions) // 1_000_000_000
+    if last_modified is not None:
+        updated_at = last_modified()
+        if updated_at is not None:
+            modified = max(modified, int(updated_at.timestamp()))
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=modified)
+    if not_modified is not None:
+        return finalize_conditional_response(not_modified, etag, modified)
+
+    if request.user.is_authenticated:
+        return finalize_conditional_response(build_response(), etag, modified)
+
+    key = f'{RESPONSE_KEY_PREFIX}{hashlib.md5(f"{versions}|{url}".encode("utf-8")).hexdigest()}'
+    cached = cache.get(key)
+    if cached is not None:
+        return finalize_conditional_response(Response(cached), etag, modified)
+
+    response = build_response()
+    if response.status_code == 200:
+        cache.set(key, plain_data(response.data), settings.CATALOG_CACHE_TIMEOUT)
+    return finalize_conditional_response(response, etag, modified)
+
+
+def finalize_conditional_response(response, etag, modified):
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified)
+    patch_vary_headers(response, ['Accept', 'Authorization'])
+    return response
@@ -0,0 +1,310 @@
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+from django.utils.text import slugify
+
+from .models import Category, Product, ProductImage, primary_image_prefetch
+from .signals import products_imported
+
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_FORMATS = IMPORT_FORMATS
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+EXPORT_FIELDS = [
+    'id', 'title', 'slug', 'description', 'category', 'seller',
+    'price', 'discount_price', 'final_price', 'stock',
+    'is_active', 'is_approved', 'is_featured',
+    'specifications', 'primary_image', 'created_at', 'updated_at',
+]
+
+# Product prices are DecimalField(max_digits=10, decimal_places=2)
+MAX_PRICE = Decimal('100000000')
+
+# Row errors kept in an import report; later ones are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+class CatalogImportError(Exception):
+    """Raised when an import row cannot be turned into a product"""
+
+
+def detect_format(filename, default='csv'):
+    if filename and filename.lower().endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if filename and filename.lower().endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def read_rows(stream, fmt):
+    """Lazily yield one dict per CSV or JSONL record from a text stream"""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    elif fmt == 'jsonl':
+        for line in stream:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield CatalogImportError(f'Invalid JSON: {e}')
+    else:
+        raise CatalogImportError(f'Unsupported format: {fmt}')
+
+
+class ImportReport:
+    """Outcome of a catalog import"""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.images = 0
+        self.error_count = 0
+        self.errors = []
+        self.started = time.monotonic()
+
+    def add_error(self, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'error': message})
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed
+        return round(self.rows / elapsed, 1) if elapsed else float(self.rows)
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'images': self.images,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_second': self.rows_per_second,
+        }
+
+
+class CatalogImporter:
+    """
+    Create products for a seller from streamed import rows.
+
+    Rows are consumed in chunks of `chunk_size`, so memory stays bounded
+    whatever the input size. Each chunk gets its slugs allocated in one go
+    and is written with bulk_create inside a transaction.
+    """
+
+    def __init__(self, seller, chunk_size=1000, create_categories=False, approve=False):
+        self.seller = seller
+        self.chunk_size = chunk_size
+        self.create_categories = create_categories
+        self.approve = approve
+        self.categories = {}
+        for category in Category.objects.all():
+            self.categories[category.slug] = category
+            self.categories[category.name.lower()] = category
+
+    def run(self, rows, progress=None):
+        report = ImportReport()
+        numbered = enumerate(rows, start=1)
+        while chunk := list(islice(numbered, self.chunk_size)):
+            batch = []
+            for row_number, row in chunk:
+                report.rows += 1
+                try:
+                    if isinstance(row, CatalogImportError):
+                        raise row
+                    batch.append(self.build_product(row))
+                except CatalogImportError as e:
+                    report.add_error(row_number, str(e))
+            self.save_batch(batch, report)
+            if progress is not None:
+                progress(report)
+        return report
+
+    def resolve_category(self, value):
+        if not value:
+            return None
+        if not isinstance(value, (str, int)) or isinstance(value, bool):
+            raise CatalogImportError('Category must be a name or slug')
+        value = str(value).strip()
+        category = self.categories.get(value.lower()) or self.categories.get(slugify(value))
+        if category is None:
+            if not self.create_categories:
+                raise CatalogImportError(f'Unknown category: {value}')
+            category, _ = Category.objects.get_or_create(name=value)
+            self.categories[category.slug] = category
+            self.categories[category.name.lower()] = category
+        return category
+
+    def build_product(self, row):
+        if not isinstance(row, dict):
+            raise CatalogImportError('Row must be an object')
+
+        title = self.text_field(row, 'title').strip()
+        if not title:
+            raise CatalogImportError('Title is required')
+        if len(title) > 255:
+            raise CatalogImportError('Title is longer than 255 characters')
+
+        specifications = row.get('specifications') or {}
+        if isinstance(specifications, str):
+            try:
+                specifications = json.loads(specifications)
+            except ValueError:
+                raise CatalogImportError('Specifications must be a JSON object')
+        if not isinstance(specifications, dict):
+            raise CatalogImportError('Specifications must be a JSON object')
+
+        images = row.get('images') or []
+        if isinstance(images, str):
+            images = [image.strip() for image in images.split('|') if image.strip()]
+        if not isinstance(images, list) or not all(isinstance(image, str) for image in images):
+            raise CatalogImportError('Images must be a list of image paths')
+        image_max_length = ProductImage._meta.get_field('image').max_length
+        for image in images:
+            if len(image) > image_max_length:
+                raise CatalogImportError(f'Image path is longer than {image_max_length} characters')
+
+        product = Product(
+            seller=self.seller,
+            category=self.resolve_category(row.get('category')),
+            title=title,
+            description=self.text_field(row, 'description'),
+            specifications=specifications,
+            price=self.parse_price(row.get('price'), 'price', required=True),
+            discount_price=self.parse_price(row.get('discount_price'), 'discount_price'),
+            stock=self.parse_stock(row.get('stock')),
+            is_approved=self.approve,
+        )
+        product.refresh_pricing()
+        product.refresh_search_text()
+        product.import_images = images
+        return product
+
+    def text_field(self, row, field):
+        value = row.get(field)
+        if value is None:
+            return ''
+        if not isinstance(value, str):
+            raise CatalogImportError(f'{field.capitalize()} must be a string')
+        return value
+
+    def parse_price(self, value, field, required=False):
+        if value in (None, ''):
+            if required:
+                raise CatalogImportError(f'{field} is required')
+            return None
+        try:
+            if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                raise InvalidOperation
+            price = Decimal(str(value))
+        except InvalidOperation:
+            raise CatalogImportError(f'Invalid {field}: {value}')
+        if not price.is_finite() or price < 0 or price >= MAX_PRICE:
+            raise CatalogImportError(f'Invalid {field}: {value}')
+        return price.quantize(Decimal('0.01'))
+
+    def parse_stock(self, value):
+        if value in (None, ''):
+            return 0
+        try:
+            if isinstance(value, bool) or not isinstance(value, (str, int)):
+                raise TypeError
+            stock = int(value)
+        except (TypeError, ValueError):
+            raise CatalogImportError(f'Invalid stock: {value}')
+        if stock < 0:
+            raise CatalogImportError(f'Invalid stock: {value}')
+        return stock
+
+    def save_batch(self, products, report):
+        if not products:
+            return
+        with transaction.atomic():
+            Product.allocate_slugs(products)
+            Product.objects.bulk_create(products)
+            images = [
+                ProductImage(product=product, image=image, alt_text=product.title,
+                             is_primary=(index == 0), order=index)
+                for product in products
+                for index, image in enumerate(product.import_images)
+            ]
+            ProductImage.objects.bulk_create(images)
+            products_imported.send(sender=Product, products=products)
+        report.created += len(products)
+        report.images += len(images)
+
+
+def export_rows(queryset, chunk_size=2000, build_url=None):
+    """
+    Lazily yield one dict per product, reading the queryset in chunks.
+
+    `build_url` turns the primary image's media URL into an absolute one.
+    """
+    queryset = (
+        queryset.select_related('category', 'seller')
+        .prefetch_related(primary_image_prefetch())
+        .order_by('pk')
+    )
+    for product in queryset.iterator(chunk_size=chunk_size):
+        primary = product.primary_image
+        image_url = None
+        if primary:
+            image_url = primary.image.url
+            if build_url is not None:
+                image_url = build_url(image_url)
+        yield {
+            'id': product.pk,
+            'title': product.title,
+            'slug': product.slug,
+            'description': product.description,
+            'category': product.category.name if product.category else None,
+            'seller': product.seller.username,
+            'price': str(product.price),
+            'discount_price': str(product.discount_price) if product.discount_price is not None else None,
+            'final_price': str(product.final_price),
+            'stock': product.stock,
+            'is_active': product.is_active,
+            'is_approved': product.is_approved,
+            'is_featured': product.is_featured,
+            'specifications': product.specifications,
+            'primary_image': image_url,
+            'created_at': product.created_at.isoformat(),
+            'updated_at': product.updated_at.isoformat(),
+        }
+
+
+class _LineBuffer:
+    """File-like object that hands back what csv.writer writes"""
+
+    def write(self, value):
+        return value
+
+
+def render_export(rows, fmt):
+    """Yield the exported catalog as CSV or JSONL text, one line at a time"""
+    if fmt == 'csv':
+        writer = csv.writer(_LineBuffer())
+        yield writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            row['specifications'] = json.dumps(row['specifications'], ensure_ascii=False)
+            yield writer.writerow([row[field] for field in EXPORT_FIELDS])
+    elif fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+    else:
+        raise CatalogImportError(f'Unsupported format: {fmt}')
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Category
+
+
+CATEGORY_TREE_CACHE_KEY = 'categories:tree'
+CATEGORY_LIST_CACHE_KEY = 'categories:rendered'
+
+
+class CategoryTree:
+    """Every category, fetched in one query and linked in memory"""
+
+    def __init__(self, categories):
+        self.categories = list(categories)
+        self.children = {}
+        self.by_slug = {}
+        for category in self.categories:
+            self.children.setdefault(category.parent_id, []).append(category)
+            self.by_slug[category.slug] = category
+
+    def subtree_ids(self, slug):
+        """Ids of the category with this slug and all of its descendants"""
+        root = self.by_slug.get(slug)
+        if root is None:
+            return []
+        if not root.path:
+            # Not given a path yet; an empty prefix would match every category
+            return [root.pk]
+        return [
+            category.pk for category in self.categories
+            if category.path.startswith(root.path)
+        ]
+
+
+def get_category_tree():
+    """Cached CategoryTree, rebuilt after any category change commits"""
+    tree = cache.get(CATEGORY_TREE_CACHE_KEY)
+    if tree is None:
+        tree = CategoryTree(Category.objects.order_by('name'))
+        # A tree read just before a concurrent change commits may be cached
+        # after that change's invalidation, so it still expires eventually
+        cache.set(CATEGORY_TREE_CACHE_KEY, tree, settings.CATALOG_CACHE_TIMEOUT)
+    return tree
+
+
+def invalidate_category_tree():
+    cache.delete_many([CATEGORY_TREE_CACHE_KEY, CATEGORY_LIST_CACHE_KEY])
@@ -0,0 +1,23 @@
+from rest_framework import filters
+
+
+class CatalogOrderingFilter(filters.OrderingFilter):
+    """
+    OrderingFilter that maps public ordering names onto stored columns.
+
+    Views declare `ordering_aliases`, e.g. {'price': 'effective_price'}, so
+    `?ordering=-price` sorts on the indexed column while the API keeps its
+    public names.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering:
+            return ordering
+        aliases = getattr(view, 'ordering_aliases', {})
+        resolved = []
+        for term in ordering:
+            prefix = '-' if term.startswith('-') else ''
+            field = term.lstrip('-')
+            resolved.append(prefix + aliases.get(field, field))
+        return resolved
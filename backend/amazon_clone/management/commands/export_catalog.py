@@ -0,0 +1,45 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from amazon_clone.catalog_io import EXPORT_FORMATS, detect_format, export_rows, render_export
+from amazon_clone.models import Product
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Stream the product catalog to a CSV or JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='Output file, or - for standard output')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--seller', help='Only export the products of this seller')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--base-url', default='',
+                            help='Prefix for image URLs, e.g. https://api.example.com')
+
+    def handle(self, *args, **options):
+        queryset = Product.objects.all()
+        if options['seller']:
+            try:
+                seller = User.objects.get(username=options['seller'])
+            except User.DoesNotExist:
+                raise CommandError(f"Seller not found: {options['seller']}")
+            queryset = queryset.filter(seller=seller)
+
+        path = options['path']
+        fmt = options['format'] or detect_format(path)
+        base_url = options['base_url'].rstrip('/')
+        rows = export_rows(
+            queryset,
+            chunk_size=options['chunk_size'],
+            build_url=(lambda url: base_url + url) if base_url else None,
+        )
+
+        if path == '-':
+            sys.stdout.writelines(render_export(rows, fmt))
+            return
+        with open(path, 'w', encoding='utf-8', newline='') as stream:
+            stream.writelines(render_export(rows, fmt))
+        self.stdout.write(self.style.SUCCESS(f'Catalog exported to {path}'))
@@ -0,0 +1,64 @@
+import io
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from amazon_clone.catalog_io import (
+    IMPORT_FORMATS, CatalogImporter, CatalogImportError, detect_format, read_rows
+)
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Import products for a seller from a CSV or JSONL file, in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file, or - for standard input')
+        parser.add_argument('--seller', required=True, help='Username of the seller')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--create-categories', action='store_true',
+                            help='Create categories that do not exist yet')
+        parser.add_argument('--approve', action='store_true',
+                            help='Mark imported products as approved')
+
+    def handle(self, *args, **options):
+        try:
+            seller = User.objects.get(username=options['seller'], role='seller')
+        except User.DoesNotExist:
+            raise CommandError(f"Seller not found: {options['seller']}")
+
+        path = options['path']
+        fmt = options['format'] or detect_format(path)
+        importer = CatalogImporter(
+            seller,
+            chunk_size=options['chunk_size'],
+            create_categories=options['create_categories'],
+            approve=options['approve'],
+        )
+
+        def progress(report):
+            self.stdout.write(
+                f'  {report.rows} rows, {report.created} created '
+                f'({report.rows_per_second} rows/s)'
+            )
+
+        self.stdout.write(f'Importing {fmt.upper()} catalog for {seller.username}...')
+        try:
+            if path == '-':
+                stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+                report = importer.run(read_rows(stream, fmt), progress=progress)
+            else:
+                with open(path, encoding='utf-8-sig', newline='') as stream:
+                    report = importer.run(read_rows(stream, fmt), progress=progress)
+        except (OSError, UnicodeDecodeError, CatalogImportError) as e:
+            raise CommandError(str(e))
+
+        for error in report.errors:
+            self.stdout.write(self.style.WARNING(f"  ! Row {error['row']}: {error['error']}"))
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {report.created} of {report.rows} rows '
+            f'({report.images} images, {report.error_count} errors) '
+            f'in {report.elapsed:.1f}s, {report.rows_per_second} rows/s'
+        ))
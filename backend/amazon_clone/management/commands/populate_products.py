@@ -98,6 +98,7 @@ class Command(BaseCommand):
                             }
                         )
         
+        Product.objects.rebuild_rating_summaries()
         self.stdout.write(self.style.SUCCESS('Database populated successfully!'))
     
     def get_review_comments(self, rating):
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from amazon_clone.cache import CATALOG, bump_catalog_versions
+from amazon_clone.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the stored rating summary (sum, count and star histogram), units sold '
+        'and the sort keys derived from them of every product'
+    )
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write('Rebuilding product rating summaries...')
+        reviewed = Product.objects.all().rebuild_rating_summaries()
+        sold = Product.objects.all().rebuild_sales_summaries()
+        bump_catalog_versions(CATALOG)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rating summaries rebuilt ({reviewed} reviewed products, {sold} sold products)'
+        ))
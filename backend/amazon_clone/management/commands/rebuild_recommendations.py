@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from amazon_clone.cache import PRODUCTS, bump_catalog_versions
+
+
+class Command(BaseCommand):
+    help = 'Fold new orders into the co-purchase matrix and refresh "frequently bought together" products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='Related products kept per product')
+        parser.add_argument('--min-count', type=int, default=1,
+                            help='Orders two products must share to be related')
+        parser.add_argument('--settle-seconds', type=int, default=300,
+                            help='Skip orders younger than this; they are picked up by the next run')
+        parser.add_argument('--chunk-size', type=int, default=50000)
+        parser.add_argument('--full', action='store_true',
+                            help='Ignore the saved matrix and rebuild from every order')
+
+    def handle(self, *args, **options):
+        try:
+            from amazon_clone.recommendations import rebuild_bought_together
+        except ImportError as e:
+            raise CommandError(f'Recommendations need numpy and scipy; pip install -r requirements-batch.txt ({e})')
+
+        self.stdout.write('Updating bought-together recommendations...')
+        last_order_id, products, relations = rebuild_bought_together(
+            k=options['top'],
+            full=options['full'],
+            min_count=options['min_count'],
+            settle_seconds=options['settle_seconds'],
+            chunk_size=options['chunk_size'],
+        )
+        if products:
+            bump_catalog_versions(PRODUCTS)
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed {products} products ({relations} relations), orders up to #{last_order_id}'
+        ))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from amazon_clone.cache import CATALOG, bump_catalog_versions
+from amazon_clone.models import Product
+from amazon_clone.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of every product'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        if backend is None:
+            raise CommandError('The configured database has no full-text search backend')
+
+        self.stdout.write('Rebuilding product search index...')
+        backend.clear()
+        chunk_size = options['chunk_size']
+        batch = []
+        total = 0
+        products = Product.objects.only('id', 'title', 'description', 'specifications', 'search_text')
+        for product in products.iterator(chunk_size=chunk_size):
+            batch.append(product)
+            if len(batch) >= chunk_size:
+                backend.index(batch)
+                total += len(batch)
+                batch = []
+        backend.index(batch)
+        total += len(batch)
+        bump_catalog_versions(CATALOG)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} products'))
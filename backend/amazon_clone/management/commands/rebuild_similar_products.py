@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from amazon_clone.cache import PRODUCTS, bump_catalog_versions
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the TF-IDF product vectors and the "similar products" of every approved product'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='Similar products kept per product')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            from amazon_clone.recommendations import rebuild_similar_products
+        except ImportError as e:
+            raise CommandError(f'Recommendations need numpy and scipy; pip install -r requirements-batch.txt ({e})')
+
+        self.stdout.write('Rebuilding similar products...')
+        products, relations = rebuild_similar_products(k=options['top'], chunk_size=options['chunk_size'])
+        bump_catalog_versions(PRODUCTS)
+        self.stdout.write(self.style.SUCCESS(f'Vectorized {products} products ({relations} relations)'))
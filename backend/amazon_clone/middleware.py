@@ -0,0 +1,159 @@
+import zlib
+
+from django.conf import settings
+from django.http import FileResponse
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# API data formats worth compressing. HTML and other text is left alone:
+# pages such as the admin carry CSRF tokens next to reflected input, which
+# compression would expose to BREACH. Everything else (images, video,
+# archives, fonts, ...) is either compressed already or not worth the CPU
+COMPRESSIBLE_TYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'application/msgpack',
+}
+
+
+def is_compressible(content_type):
+    media_type = content_type.split(';')[0].strip().lower()
+    return media_type.endswith('+json') or media_type in COMPRESSIBLE_TYPES
+
+
+def parse_accept_encoding(header):
+    """Map each coding in an Accept-Encoding header to its q-value"""
+    codings = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        codings[coding] = quality
+    return codings
+
+
+class GzipCompressor:
+    def __init__(self, level):
+        # wbits 16 + MAX_WBITS writes a gzip header and trailer
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def process(self, data):
+        return self.compressor.compress(data)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def process(self, data):
+        return self.compressor.process(data)
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with Brotli or gzip, whichever the client prefers.
+
+    Only API responses (JSON, NDJSON and MessagePack) of at least
+    COMPRESSION_MIN_SIZE bytes are compressed, at COMPRESSION_GZIP_LEVEL / COMPRESSION_BROTLI_QUALITY.
+    Streaming responses are compressed chunk by chunk as they are sent.
+    Responses that already have a Content-Encoding and files (static and
+    media, which WhiteNoise serves precompressed) are left alone. Brotli is
+    only offered when the brotli package is installed.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+        self.gzip_level = getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6)
+        self.brotli_quality = getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        return self.process_response(request, response)
+
+    def choose_encoding(self, request):
+        codings = parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+        # Highest q-value wins; on a tie the first (better) candidate does
+        best, best_quality = None, 0.0
+        for coding in candidates:
+            quality = codings.get(coding, codings.get('*', 0.0))
+            if quality > best_quality:
+                best, best_quality = coding, quality
+        return best
+
+    def compressor(self, encoding):
+        if encoding == 'br':
+            return BrotliCompressor(self.brotli_quality)
+        return GzipCompressor(self.gzip_level)
+
+    def process_response(self, request, response):
+        if (response.has_header('Content-Encoding') or isinstance(response, FileResponse) or
+                not is_compressible(response.get('Content-Type', ''))):
+            return response
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self.choose_encoding(request)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = self.compress_stream(
+                response.streaming_content, encoding, response.is_async
+            )
+            # The compressed size is only known once the stream ends
+            del response.headers['Content-Length']
+        else:
+            compressor = self.compressor(encoding)
+            content = compressor.process(response.content) + compressor.finish()
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response.headers['Content-Length'] = str(len(content))
+
+        # The compressed body is a different representation, so a strong
+        # ETag becomes weak; If-None-Match still matches it
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def compress_stream(self, chunks, encoding, is_async):
+        compressor = self.compressor(encoding)
+        if is_async:
+            async def compress():
+                async for chunk in chunks:
+                    if data := compressor.process(chunk):
+                        yield data
+                yield compressor.finish()
+            return compress()
+
+        def compress():
+            for chunk in chunks:
+                if data := compressor.process(chunk):
+                    yield data
+            yield compressor.finish()
+        return compress()
@@ -0,0 +1,89 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:04
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_rating_summaries(apps, schema_editor):
+    Product = apps.get_model("amazon_clone", "Product")
+    Review = apps.get_model("amazon_clone", "Review")
+    summaries = {}
+    counts = (
+        Review.objects.values_list("product_id", "rating")
+        .annotate(total=Count("id"))
+        .order_by()
+    )
+    for product_id, rating, total in counts:
+        summary = summaries.setdefault(
+            product_id,
+            {
+                "rating_sum": 0,
+                "rating_count": 0,
+                **{f"rating_{i}": 0 for i in range(1, 6)},
+            },
+        )
+        summary["rating_sum"] += rating * total
+        summary["rating_count"] += total
+        summary[f"rating_{rating}"] += total
+    for product_id, summary in summaries.items():
+        Product.objects.filter(pk=product_id).update(**summary)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("amazon_clone", "0002_product_is_approved"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="rating_1",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="1 Star Ratings"
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_2",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="2 Star Ratings"
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_3",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="3 Star Ratings"
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_4",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="4 Star Ratings"
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_5",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="5 Star Ratings"
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Rating Count"
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_sum",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Rating Sum"
+            ),
+        ),
+        migrations.RunPython(backfill_rating_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,104 @@
+import unicodedata
+from itertools import islice
+
+from django.db import migrations
+
+# Frozen copies of amazon_clone.search as of this migration, so later
+# changes to the app code cannot change what it does
+SQLITE_TABLE = "amazon_clone_product_fts"
+POSTGRES_TABLE = "amazon_clone_product_search"
+
+
+def fold_text(value):
+    if not value:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", str(value))
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def specification_text(specifications):
+    values = []
+    stack = [specifications]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+        elif item is not None:
+            values.append(str(item))
+    return " ".join(reversed(values))
+
+
+def document_rows(products):
+    return [
+        (
+            product.pk,
+            fold_text(product.title),
+            fold_text(product.description),
+            fold_text(specification_text(product.specifications)),
+        )
+        for product in products
+    ]
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} "
+            f"USING fts5(title, description, specifications, "
+            f"tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(f"DELETE FROM {SQLITE_TABLE}")
+        insert = (
+            f"INSERT INTO {SQLITE_TABLE} (rowid, title, description, specifications) "
+            f"VALUES (%s, %s, %s, %s)"
+        )
+    elif connection.vendor == "postgresql":
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {POSTGRES_TABLE} ("
+            f"product_id bigint PRIMARY KEY "
+            f"REFERENCES amazon_clone_product (id) ON DELETE CASCADE "
+            f"DEFERRABLE INITIALLY DEFERRED, "
+            f"document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_document_gin "
+            f"ON {POSTGRES_TABLE} USING GIN (document)"
+        )
+        insert = (
+            f"INSERT INTO {POSTGRES_TABLE} (product_id, document) VALUES (%s, "
+            f"setweight(to_tsvector('simple', %s), 'A') || "
+            f"setweight(to_tsvector('simple', %s), 'C') || "
+            f"setweight(to_tsvector('simple', %s), 'B')) "
+            f"ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document"
+        )
+    else:
+        return
+
+    Product = apps.get_model("amazon_clone", "Product")
+    products = Product.objects.only("id", "title", "description", "specifications")
+    iterator = products.iterator(chunk_size=1000)
+    while batch := list(islice(iterator, 1000)):
+        with connection.cursor() as cursor:
+            cursor.executemany(insert, document_rows(batch))
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SQLITE_TABLE}")
+    elif connection.vendor == "postgresql":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {POSTGRES_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("amazon_clone", "0003_product_rating_summary"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
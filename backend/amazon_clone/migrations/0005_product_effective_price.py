@@ -0,0 +1,52 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:08
+
+from django.db import migrations, models
+
+
+def backfill_pricing(apps, schema_editor):
+    Product = apps.get_model("amazon_clone", "Product")
+    batch = []
+    products = Product.objects.only("id", "price", "discount_price")
+    for product in products.iterator(chunk_size=1000):
+        final_price = product.discount_price if product.discount_price else product.price
+        product.effective_price = final_price
+        product.discount_rate = 0
+        if product.discount_price and product.discount_price < product.price:
+            product.discount_rate = int(
+                ((product.price - product.discount_price) / product.price) * 100
+            )
+        batch.append(product)
+        if len(batch) >= 1000:
+            Product.objects.bulk_update(batch, ["effective_price", "discount_rate"])
+            batch = []
+    Product.objects.bulk_update(batch, ["effective_price", "discount_rate"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("amazon_clone", "0004_product_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="discount_rate",
+            field=models.PositiveSmallIntegerField(
+                db_index=True, default=0, editable=False, verbose_name="Discount Rate"
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="effective_price",
+            field=models.DecimalField(
+                db_index=True,
+                decimal_places=2,
+                default=0,
+                editable=False,
+                max_digits=10,
+                verbose_name="Effective Price",
+            ),
+        ),
+        migrations.RunPython(backfill_pricing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:08
+
+from django.db import migrations, models
+
+
+def backfill_category_paths(apps, schema_editor):
+    Category = apps.get_model("amazon_clone", "Category")
+    parents = dict(Category.objects.values_list("id", "parent_id"))
+    paths = {}
+
+    def build_path(category_id):
+        if category_id not in paths:
+            parent_id = parents[category_id]
+            parent_path = build_path(parent_id) if parent_id else ""
+            paths[category_id] = f"{parent_path}{category_id}/"
+        return paths[category_id]
+
+    for category_id in parents:
+        Category.objects.filter(pk=category_id).update(path=build_path(category_id))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("amazon_clone", "0005_product_effective_price"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="path",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                max_length=255,
+                verbose_name="Path",
+            ),
+        ),
+        migrations.RunPython(backfill_category_paths, migrations.RunPython.noop),
+    ]
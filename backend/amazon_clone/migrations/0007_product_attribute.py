@@ -0,0 +1,85 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Frozen copy of ProductAttribute.specification_pairs as of this migration
+def specification_pairs(specifications):
+    pairs = set()
+    if not isinstance(specifications, dict):
+        return pairs
+    for key, value in specifications.items():
+        key = str(key).strip()[:100]
+        values = value if isinstance(value, (list, tuple)) else [value]
+        for item in values:
+            if item is None or isinstance(item, (dict, list, tuple)):
+                continue
+            item = str(item).strip()[:255]
+            if key and item:
+                pairs.add((key, item))
+    return pairs
+
+
+def backfill_attributes(apps, schema_editor):
+    Product = apps.get_model("amazon_clone", "Product")
+    ProductAttribute = apps.get_model("amazon_clone", "ProductAttribute")
+    batch = []
+    products = Product.objects.only("id", "specifications")
+    for product in products.iterator(chunk_size=1000):
+        pairs = specification_pairs(product.specifications)
+        batch.extend(
+            ProductAttribute(product_id=product.pk, key=key, value=value)
+            for key, value in pairs
+        )
+        if len(batch) >= 1000:
+            ProductAttribute.objects.bulk_create(batch)
+            batch = []
+    ProductAttribute.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("amazon_clone", "0006_category_path"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductAttribute",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=100, verbose_name="Key")),
+                ("value", models.CharField(max_length=255, verbose_name="Value")),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="attributes",
+                        to="amazon_clone.product",
+                        verbose_name="Product",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Product Attribute",
+                "verbose_name_plural": "Product Attributes",
+                "indexes": [
+                    models.Index(
+                        fields=["key", "value", "product"],
+                        name="product_attribute_lookup",
+                    )
+                ],
+                "unique_together": {("product", "key", "value")},
+            },
+        ),
+        migrations.RunPython(backfill_attributes, migrations.RunPython.noop),
+    ]
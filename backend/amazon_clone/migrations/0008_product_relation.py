@@ -0,0 +1,68 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("amazon_clone", "0007_product_attribute"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductRelation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("bought_together", "Frequently Bought Together")],
+                        max_length=20,
+                        verbose_name="Kind",
+                    ),
+                ),
+                ("rank", models.PositiveSmallIntegerField(verbose_name="Rank")),
+                ("score", models.FloatField(verbose_name="Score")),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="relations",
+                        to="amazon_clone.product",
+                        verbose_name="Product",
+                    ),
+                ),
+                (
+                    "related",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="amazon_clone.product",
+                        verbose_name="Related Product",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Product Relation",
+                "verbose_name_plural": "Product Relations",
+                "ordering": ["product", "kind", "rank"],
+                "indexes": [
+                    models.Index(
+                        fields=["product", "kind", "rank"],
+                        name="product_relation_lookup",
+                    )
+                ],
+                "unique_together": {("product", "kind", "related")},
+            },
+        ),
+    ]
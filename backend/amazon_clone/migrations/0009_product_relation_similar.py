@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("amazon_clone", "0008_product_relation"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="productrelation",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("bought_together", "Frequently Bought Together"),
+                    ("similar", "Similar"),
+                ],
+                max_length=20,
+                verbose_name="Kind",
+            ),
+        ),
+    ]
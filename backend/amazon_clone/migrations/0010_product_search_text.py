@@ -0,0 +1,101 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:23
+
+import re
+import unicodedata
+from itertools import islice
+
+from django.db import migrations, models
+
+# Frozen copies of amazon_clone.search as of this migration, so later
+# changes to the app code cannot change what it does
+SQLITE_TRIGRAM_TABLE = "amazon_clone_product_trigram"
+POSTGRES_TRIGRAM_INDEX = "amazon_clone_product_search_text_trgm"
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fold_text(value):
+    if not value:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", str(value))
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def trigrams(value):
+    grams = set()
+    for token in TOKEN_RE.findall(fold_text(value)):
+        padded = f"  {token} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def create_trigram_index(apps, schema_editor):
+    connection = schema_editor.connection
+    Product = apps.get_model("amazon_clone", "Product")
+
+    products = Product.objects.only("id", "title", "description")
+    iterator = products.iterator(chunk_size=1000)
+    while batch := list(islice(iterator, 1000)):
+        for product in batch:
+            product.search_text = " ".join(
+                fold_text(f"{product.title} {product.description}").split()
+            )
+        Product.objects.bulk_update(batch, ["search_text"])
+
+    if connection.vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {SQLITE_TRIGRAM_TABLE} ("
+            f"trigram TEXT NOT NULL, "
+            f"product_id INTEGER NOT NULL, "
+            f"PRIMARY KEY (trigram, product_id)) WITHOUT ROWID"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {SQLITE_TRIGRAM_TABLE}_product "
+            f"ON {SQLITE_TRIGRAM_TABLE} (product_id)"
+        )
+        products = Product.objects.only("id", "search_text")
+        iterator = products.iterator(chunk_size=1000)
+        while batch := list(islice(iterator, 1000)):
+            rows = [
+                (gram, product.pk)
+                for product in batch
+                for gram in trigrams(product.search_text)
+            ]
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f"INSERT OR IGNORE INTO {SQLITE_TRIGRAM_TABLE} (trigram, product_id) "
+                    f"VALUES (%s, %s)",
+                    rows,
+                )
+    elif connection.vendor == "postgresql":
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {POSTGRES_TRIGRAM_INDEX} "
+            f"ON amazon_clone_product USING GIN (search_text gin_trgm_ops)"
+        )
+
+
+def drop_trigram_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SQLITE_TRIGRAM_TABLE}")
+    elif connection.vendor == "postgresql":
+        schema_editor.execute(f"DROP INDEX IF EXISTS {POSTGRES_TRIGRAM_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("amazon_clone", "0009_product_relation_similar"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="search_text",
+            field=models.TextField(
+                default="", editable=False, verbose_name="Search Text"
+            ),
+        ),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:29
+
+from django.db import migrations, models
+from django.db.models import Case, F, FloatField, Sum, Value, When
+
+
+def backfill_rankings(apps, schema_editor):
+    Product = apps.get_model("amazon_clone", "Product")
+    OrderItem = apps.get_model("amazon_clone", "OrderItem")
+
+    totals = (
+        OrderItem.objects.exclude(order__status__in=("cancelled", "refunded"))
+        .values_list("product_id")
+        .annotate(total=Sum("quantity"))
+        .order_by()
+    )
+    products = [Product(pk=product_id, units_sold=total) for product_id, total in totals]
+    Product.objects.bulk_update(products, ["units_sold"], batch_size=500)
+    Product.objects.update(
+        average_rating=Case(
+            When(rating_count=0, then=Value(0.0)),
+            default=F("rating_sum") * 1.0 / F("rating_count"),
+            output_field=FloatField(),
+        ),
+        popularity_score=F("units_sold") + F("rating_count"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("amazon_clone", "0010_product_search_text"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="average_rating",
+            field=models.FloatField(
+                db_index=True, default=0, editable=False, verbose_name="Average Rating"
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="popularity_score",
+            field=models.PositiveIntegerField(
+                db_index=True,
+                default=0,
+                editable=False,
+                verbose_name="Popularity Score",
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="units_sold",
+            field=models.PositiveIntegerField(
+                db_index=True, default=0, editable=False, verbose_name="Units Sold"
+            ),
+        ),
+        migrations.RunPython(backfill_rankings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("amazon_clone", "0011_product_rankings"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["buyer", "-created_at"], name="order_buyer_recent"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="orderitem",
+            index=models.Index(fields=["seller", "order"], name="order_item_seller"),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(("is_active", True), ("is_approved", True)),
+                fields=["-created_at", "-id"],
+                name="product_public_recent",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(("is_active", True), ("is_approved", True)),
+                fields=["category", "-created_at", "-id"],
+                name="product_public_category",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(
+                    ("is_active", True), ("is_approved", True), ("is_featured", True)
+                ),
+                fields=["-created_at", "-id"],
+                name="product_featured_recent",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["seller", "-created_at", "-id"], name="product_seller_recent"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["product", "-created_at"], name="review_product_recent"
+            ),
+        ),
+    ]
@@ -1,10 +1,15 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, FloatField, Prefetch, Q, Sum, Value, When, prefetch_related_objects
+from django.db.models.functions import Concat, Greatest, Substr
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils.translation import gettext_lazy as _
 from django.utils.text import slugify
+import re
 import uuid
 
+from .search import fold_text
+
 
 class User(AbstractUser):
     """Custom User model with buyer/seller roles"""
@@ -76,6 +81,14 @@ class Category(models.Model):
         related_name='subcategories',
         verbose_name=_('Parent Category')
     )
+    # Materialized path of ancestor ids ending with this category, e.g. "1/4/"
+    path = models.CharField(
+        max_length=255,
+        blank=True,
+        editable=False,
+        db_index=True,
+        verbose_name=_('Path')
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -86,7 +99,31 @@ class Category(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
+        # The path needs the id of a new category, so it is written right
+        # after the insert, in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            path = self.build_path()
+            if path != self.path:
+                old_path = self.path
+                self.path = path
+                Category.objects.filter(pk=self.pk).update(path=path)
+                if old_path:
+                    # Move the whole subtree along with this category
+                    Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                        path=Concat(Value(path), Substr('path', len(old_path) + 1))
+                    )
+
+    def build_path(self):
+        parent_path = ''
+        if self.parent_id:
+            parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).first() or ''
+        return f'{parent_path}{self.pk}/'
+
+    @property
+    def depth(self):
+        return self.path.count('/') - 1
 
     def __str__(self):
         return self.name
@@ -99,6 +136,48 @@ class ProductQuerySet(models.QuerySet):
     def pending_approval(self):
         return self.filter(is_approved=False, is_active=True)
 
+    def rebuild_rating_summaries(self):
+        """Recompute the stored rating summary of these products from their reviews"""
+        summaries = {}
+        counts = (
+            Review.objects.filter(product__in=self)
+            .values_list('product_id', 'rating')
+            .annotate(total=Count('id'))
+            .order_by()
+        )
+        for product_id, rating, total in counts:
+            summary = summaries.setdefault(product_id, Product.empty_rating_summary())
+            summary['rating_sum'] += rating * total
+            summary['rating_count'] += total
+            summary[f'rating_{rating}'] += total
+
+        with transaction.atomic():
+            self.update(**Product.empty_rating_summary())
+            products = []
+            for product_id, summary in summaries.items():
+                products.append(Product(pk=product_id, **summary))
+            Product.objects.bulk_update(
+                products, list(Product.RATING_SUMMARY_FIELDS), batch_size=500
+            )
+            self.update(**Product.ranking_expressions())
+        return len(summaries)
+
+    def rebuild_sales_summaries(self):
+        """Recompute the stored units sold of these products from their order items"""
+        totals = (
+            OrderItem.objects.filter(product__in=self)
+            .exclude(order__status__in=Order.UNSOLD_STATUSES)
+            .values_list('product_id')
+            .annotate(total=Sum('quantity'))
+            .order_by()
+        )
+        with transaction.atomic():
+            self.update(units_sold=0)
+            products = [Product(pk=product_id, units_sold=total) for product_id, total in totals]
+            Product.objects.bulk_update(products, ['units_sold'], batch_size=500)
+            self.update(**Product.ranking_expressions())
+        return len(products)
+
 
 class Product(models.Model):
     """Product model for items sold on the platform"""
@@ -150,6 +229,22 @@ class Product(models.Model):
         validators=[MinValueValidator(0)],
         verbose_name=_('Discount Price')
     )
+    # Stored copies of final_price and discount_percentage so price filters
+    # and sorting run on indexes; kept in sync by save()
+    effective_price = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        default=0,
+        editable=False,
+        db_index=True,
+        verbose_name=_('Effective Price')
+    )
+    discount_rate = models.PositiveSmallIntegerField(
+        default=0,
+        editable=False,
+        db_index=True,
+        verbose_name=_('Discount Rate')
+    )
     stock = models.PositiveIntegerField(
         default=0,
         verbose_name=_('Stock')
@@ -166,28 +261,154 @@ class Product(models.Model):
         default=False,
         verbose_name=_('Featured')
     )
+    # Lowercased, accent-folded title and description, kept in sync by
+    # save() and matched by the trigram index for fuzzy search
+    search_text = models.TextField(
+        default='',
+        editable=False,
+        verbose_name=_('Search Text')
+    )
+    # Rating summary, kept in sync with the product's reviews
+    rating_sum = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_('Rating Sum')
+    )
+    rating_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_('Rating Count')
+    )
+    rating_1 = models.PositiveIntegerField(default=0, editable=False, verbose_name=_('1 Star Ratings'))
+    rating_2 = models.PositiveIntegerField(default=0, editable=False, verbose_name=_('2 Star Ratings'))
+    rating_3 = models.PositiveIntegerField(default=0, editable=False, verbose_name=_('3 Star Ratings'))
+    rating_4 = models.PositiveIntegerField(default=0, editable=False, verbose_name=_('4 Star Ratings'))
+    rating_5 = models.PositiveIntegerField(default=0, editable=False, verbose_name=_('5 Star Ratings'))
+    # Stored sort keys for "top rated", "best sellers" and "popular", kept in
+    # sync with reviews and checkouts so these orderings run on indexes.
+    # Popularity is units sold plus number of reviews
+    average_rating = models.FloatField(
+        default=0,
+        editable=False,
+        db_index=True,
+        verbose_name=_('Average Rating')
+    )
+    units_sold = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        db_index=True,
+        verbose_name=_('Units Sold')
+    )
+    popularity_score = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        db_index=True,
+        verbose_name=_('Popularity Score')
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    PRICING_FIELDS = ('effective_price', 'discount_rate')
+
+    RATING_SUMMARY_FIELDS = (
+        'rating_sum', 'rating_count',
+        'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5',
+    )
+
+    # Maintained with F() updates as reviews and orders are written, so
+    # save() never writes them back from a possibly stale instance
+    COUNTER_FIELDS = (*RATING_SUMMARY_FIELDS, 'average_rating', 'units_sold', 'popularity_score')
+
     class Meta:
         verbose_name = _('Product')
         verbose_name_plural = _('Products')
         ordering = ['-created_at']
+        # Newest first with the id tiebreak of keyset pagination; the public
+        # catalog only ever reads approved, active products
+        indexes = [
+            models.Index(
+                fields=['-created_at', '-id'], name='product_public_recent',
+                condition=Q(is_active=True, is_approved=True),
+            ),
+            models.Index(
+                fields=['category', '-created_at', '-id'], name='product_public_category',
+                condition=Q(is_active=True, is_approved=True),
+            ),
+            models.Index(
+                fields=['-created_at', '-id'], name='product_featured_recent',
+                condition=Q(is_active=True, is_approved=True, is_featured=True),
+            ),
+            models.Index(fields=['seller', '-created_at', '-id'], name='product_seller_recent'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            base_slug = slugify(self.title)
-            slug = base_slug
-            counter = 1
-            while Product.objects.filter(slug=slug).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
+            Product.allocate_slugs([self])
+        self.refresh_pricing()
+        self.refresh_search_text()
+        if kwargs.get('update_fields') is None and not self._state.adding and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+                and field.attname not in deferred
+            ]
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'price', 'discount_price'} & set(update_fields):
+            update_fields = kwargs['update_fields'] = {*update_fields, *self.PRICING_FIELDS}
+        if update_fields is not None and {'title', 'description'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'search_text'}
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def allocate_slugs(cls, products, batch_size=100):
+        """
+        Assign a unique slug to every product without one.
+
+        Slugs already taken are looked up with one query per batch of
+        distinct base slugs, matching only the base itself and its numbered
+        forms, and products in the same call never collide with each other,
+        so unsaved products can go straight to bulk_create.
+        """
+        pending = {}
+        for product in products:
+            if not product.slug:
+                pending.setdefault(slugify(product.title) or 'product', []).append(product)
+
+        bases = list(pending)
+        for start in range(0, len(bases), batch_size):
+            chunk = bases[start:start + batch_size]
+            candidates = Q()
+            for base_slug in chunk:
+                # The prefix can use the slug index; the pattern drops other
+                # slugs sharing it, e.g. "phone-case" for "phone"
+                candidates |= Q(slug=base_slug) | Q(
+                    slug__startswith=f'{base_slug}-', slug__regex=rf'^{re.escape(base_slug)}-[0-9]+$'
+                )
+            taken = set(cls.objects.filter(candidates).values_list('slug', flat=True))
+
+            for base_slug in chunk:
+                counter = 0
+                for product in pending[base_slug]:
+                    slug = base_slug
+                    while slug in taken:
+                        counter += 1
+                        slug = f"{base_slug}-{counter}"
+                    taken.add(slug)
+                    product.slug = slug
+
+    def refresh_pricing(self):
+        """Recompute the stored effective price and discount rate"""
+        self.effective_price = self.final_price
+        self.discount_rate = self.discount_percentage
+
+    def refresh_search_text(self):
+        """Recompute the stored folded text matched by fuzzy search"""
+        self.search_text = ' '.join(fold_text(f'{self.title} {self.description}').split())
+
     @property
     def final_price(self):
         """Return the final price (discount price if available, otherwise regular price)"""
@@ -201,17 +422,65 @@ class Product(models.Model):
         return 0
 
     @property
-    def average_rating(self):
-        """Calculate average rating from reviews"""
-        reviews = self.reviews.all()
-        if reviews:
-            return sum(review.rating for review in reviews) / len(reviews)
-        return 0
+    def review_count(self):
+        """Total number of reviews from the stored rating summary"""
+        return self.rating_count
 
     @property
-    def review_count(self):
-        """Get total number of reviews"""
-        return self.reviews.count()
+    def primary_image(self):
+        """Primary ProductImage, using the batch-loaded one when available"""
+        if hasattr(self, 'primary_images'):
+            return self.primary_images[0] if self.primary_images else None
+        return self.images.filter(is_primary=True).first()
+
+    @property
+    def rating_histogram(self):
+        """Number of reviews per star rating"""
+        return {str(stars): getattr(self, f'rating_{stars}') for stars in range(1, 6)}
+
+    @staticmethod
+    def empty_rating_summary():
+        return {field: 0 for field in Product.RATING_SUMMARY_FIELDS}
+
+    @classmethod
+    def update_rating_summary(cls, product_id, added=None, removed=None):
+        """Atomically apply a review rating being added and/or removed"""
+        deltas = {}
+        for rating, sign in ((added, 1), (removed, -1)):
+            if rating is None:
+                continue
+            for field, amount in (('rating_sum', rating), ('rating_count', 1), (f'rating_{rating}', 1)):
+                deltas[field] = deltas.get(field, 0) + sign * amount
+        changes = {field: F(field) + delta for field, delta in deltas.items() if delta}
+        if changes:
+            products = cls.objects.filter(pk=product_id)
+            products.update(**changes)
+            products.update(**cls.ranking_expressions())
+
+    @classmethod
+    def record_sales(cls, quantities, returned=False):
+        """Atomically add (or, for orders that fell through, take back) units sold per product id"""
+        for product_id, quantity in quantities.items():
+            delta = -quantity if returned else quantity
+            cls.objects.filter(pk=product_id).update(
+                units_sold=Greatest(F('units_sold') + delta, Value(0))
+            )
+        if quantities:
+            cls.objects.filter(pk__in=list(quantities)).update(
+                popularity_score=cls.ranking_expressions()['popularity_score']
+            )
+
+    @staticmethod
+    def ranking_expressions():
+        """Updates deriving the stored sort keys from the rating summary and units sold"""
+        return {
+            'average_rating': Case(
+                When(rating_count=0, then=Value(0.0)),
+                default=F('rating_sum') * 1.0 / F('rating_count'),
+                output_field=FloatField(),
+            ),
+            'popularity_score': F('units_sold') + F('rating_count'),
+        }
 
 
 class ProductImage(models.Model):
@@ -250,6 +519,151 @@ class ProductImage(models.Model):
         return f"{self.product.title} - Image {self.order}"
 
 
+def primary_image_prefetch(lookup='images'):
+    """Prefetch that stores only the primary image in `primary_images`"""
+    return Prefetch(
+        lookup,
+        queryset=ProductImage.objects.filter(is_primary=True),
+        to_attr='primary_images'
+    )
+
+
+def load_primary_images(products):
+    """Resolve the primary image of every product with a single query"""
+    prefetch_related_objects(list(products), primary_image_prefetch())
+
+
+class ProductAttribute(models.Model):
+    """Normalized (product, key, value) index over Product.specifications"""
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='attributes',
+        verbose_name=_('Product')
+    )
+    key = models.CharField(
+        max_length=100,
+        verbose_name=_('Key')
+    )
+    value = models.CharField(
+        max_length=255,
+        verbose_name=_('Value')
+    )
+
+    class Meta:
+        verbose_name = _('Product Attribute')
+        verbose_name_plural = _('Product Attributes')
+        unique_together = ['product', 'key', 'value']
+        indexes = [
+            models.Index(fields=['key', 'value', 'product'], name='product_attribute_lookup'),
+        ]
+
+    def __str__(self):
+        return f"{self.key}={self.value}"
+
+    @staticmethod
+    def specification_pairs(specifications):
+        """(key, value) pairs indexed for a specifications JSON object"""
+        pairs = set()
+        if not isinstance(specifications, dict):
+            return pairs
+        for key, value in specifications.items():
+            key = str(key).strip()[:100]
+            values = value if isinstance(value, (list, tuple)) else [value]
+            for item in values:
+                if item is None or isinstance(item, (dict, list, tuple)):
+                    continue
+                item = str(item).strip()[:255]
+                if key and item:
+                    pairs.add((key, item))
+        return pairs
+
+    @classmethod
+    def refresh_for(cls, products):
+        """Bring the attribute rows of these products in line with their specifications"""
+        products = [product for product in products if product.pk]
+        if not products:
+            return
+        existing = {}
+        rows = cls.objects.filter(product__in=products).values_list('id', 'product_id', 'key', 'value')
+        for row_id, product_id, key, value in rows:
+            existing.setdefault(product_id, {})[(key, value)] = row_id
+
+        stale = []
+        missing = []
+        for product in products:
+            current = existing.get(product.pk, {})
+            wanted = cls.specification_pairs(product.specifications)
+            stale.extend(row_id for pair, row_id in current.items() if pair not in wanted)
+            missing.extend(
+                cls(product_id=product.pk, key=key, value=value)
+                for key, value in wanted if (key, value) not in current
+            )
+        if stale:
+            cls.objects.filter(id__in=stale).delete()
+        if missing:
+            cls.objects.bulk_create(missing, batch_size=1000)
+
+
+class ProductRelation(models.Model):
+    """Precomputed top-K neighbors of a product, one row per (product, kind, related)"""
+    KIND_CHOICES = [
+        ('bought_together', _('Frequently Bought Together')),
+        ('similar', _('Similar')),
+    ]
+
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='relations',
+        verbose_name=_('Product')
+    )
+    related = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_('Related Product')
+    )
+    kind = models.CharField(
+        max_length=20,
+        choices=KIND_CHOICES,
+        verbose_name=_('Kind')
+    )
+    rank = models.PositiveSmallIntegerField(verbose_name=_('Rank'))
+    score = models.FloatField(verbose_name=_('Score'))
+
+    class Meta:
+        verbose_name = _('Product Relation')
+        verbose_name_plural = _('Product Relations')
+        ordering = ['product', 'kind', 'rank']
+        unique_together = ['product', 'kind', 'related']
+        indexes = [
+            models.Index(fields=['product', 'kind', 'rank'], name='product_relation_lookup'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_id} ({self.kind})"
+
+    @classmethod
+    def replace_for(cls, kind, neighbors, batch_size=1000):
+        """
+        Replace the `kind` relations of the products in `neighbors`, a dict
+        mapping a product id to its [(related id, score), ...] best first.
+        """
+        product_ids = list(neighbors)
+        rows = [
+            cls(product_id=product_id, related_id=related_id, kind=kind, rank=rank, score=score)
+            for product_id in product_ids
+            for rank, (related_id, score) in enumerate(neighbors[product_id], start=1)
+        ]
+        with transaction.atomic():
+            for start in range(0, len(product_ids), batch_size):
+                cls.objects.filter(
+                    kind=kind, product_id__in=product_ids[start:start + batch_size]
+                ).delete()
+            cls.objects.bulk_create(rows, batch_size=batch_size)
+        return len(rows)
+
 class Order(models.Model):
     """Customer orders"""
     STATUS_CHOICES = [
@@ -262,6 +676,8 @@ class Order(models.Model):
         ('cancelled', _('Cancelled')),
         ('refunded', _('Refunded')),
     ]
+    # Orders in these states never turn into (or no longer count as) sales
+    UNSOLD_STATUSES = ('cancelled', 'refunded')
 
     order_number = models.CharField(
         max_length=50,
@@ -307,6 +723,9 @@ class Order(models.Model):
         verbose_name = _('Order')
         verbose_name_plural = _('Orders')
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['buyer', '-created_at'], name='order_buyer_recent'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.order_number:
@@ -316,6 +735,12 @@ class Order(models.Model):
     def __str__(self):
         return f"Order {self.order_number} - {self.buyer.username}"
 
+    def item_quantities(self):
+        """Units of each product in this order, by product id"""
+        return dict(
+            self.items.values_list('product_id').annotate(total=Sum('quantity')).order_by()
+        )
+
 
 class OrderItem(models.Model):
     """Items in an order"""
@@ -353,6 +778,10 @@ class OrderItem(models.Model):
     class Meta:
         verbose_name = _('Order Item')
         verbose_name_plural = _('Order Items')
+        indexes = [
+            # Seller dashboards and order lists join a seller's items to their orders
+            models.Index(fields=['seller', 'order'], name='order_item_seller'),
+        ]
 
     def __str__(self):
         return f"{self.quantity}x {self.product.title}"
@@ -397,6 +826,9 @@ class Review(models.Model):
         verbose_name_plural = _('Reviews')
         ordering = ['-created_at']
         unique_together = ['product', 'buyer']
+        indexes = [
+            models.Index(fields=['product', '-created_at'], name='review_product_recent'),
+        ]
 
     def __str__(self):
         return f"{self.buyer.username} - {self.product.title} ({self.rating}★)"
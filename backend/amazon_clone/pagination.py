@@ -0,0 +1,167 @@
+import base64
+import json
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on (ordering field, id).
+
+    Each page is fetched with a `WHERE (field, id) > (last value, last id)`
+    condition instead of OFFSET, and no COUNT(*) is run, so page N costs the
+    same as page 1. Searches without an explicit ordering are keyed on their
+    relevance rank, the order FullTextSearchFilter returns them in.
+    """
+    cursor_query_param = 'cursor'
+    page_query_param = 'page'
+    page_size = api_settings.PAGE_SIZE
+    ordering = '-created_at'
+    rank_field = 'search_rank'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = remove_query_param(request.build_absolute_uri(), self.page_query_param)
+        self.field, self.descending = self.get_ordering(request, queryset, view)
+
+        cursor = self.decode_cursor(request, queryset)
+        if cursor is None:
+            value, pk, self.reverse = None, None, False
+        else:
+            value, pk, self.reverse = cursor
+
+        # Walking backwards flips the sort direction and the page is
+        # reversed again once fetched
+        descending = self.descending != self.reverse
+        prefix = '-' if descending else ''
+        queryset = self.load_ordering_field(queryset).order_by(f'{prefix}{self.field}', f'{prefix}pk')
+        if cursor is not None:
+            op = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__{op}': value}) |
+                Q(**{self.field: value, f'pk__{op}': pk})
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+            self.has_next = cursor is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+        self.page = results
+        return results
+
+    def get_ordering(self, request, queryset, view):
+        """Return the (field, descending) pair the pages are keyed on"""
+        if (self.rank_field in queryset.query.annotations and
+                not request.query_params.get(api_settings.ORDERING_PARAM)):
+            return self.rank_field, True
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if hasattr(backend, 'get_ordering'):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        if not ordering:
+            ordering = getattr(view, 'ordering', None) or self.ordering
+        if isinstance(ordering, str):
+            ordering = [ordering]
+        term = ordering[0]
+        return term.lstrip('-'), term.startswith('-')
+
+    def load_ordering_field(self, queryset):
+        """Undo any deferral of the ordering column, which every cursor link reads"""
+        names, defer = queryset.query.deferred_loading
+        if defer and self.field in names:
+            return queryset.defer(None).defer(*(names - {self.field}))
+        if not defer and self.field not in names and self.field not in queryset.query.annotations:
+            return queryset.only(*names, self.field)
+        return queryset
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, pk, reverse = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            value = self.clean_cursor_value(queryset, self.field, value)
+            pk = self.clean_cursor_value(queryset, 'pk', pk)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk, bool(reverse)
+
+    def clean_cursor_value(self, queryset, name, value):
+        """Convert a cursor value with the field it is compared to, rejecting tampered values"""
+        if name in queryset.query.annotations:
+            field = queryset.query.annotations[name].output_field
+        elif name == 'pk':
+            field = queryset.model._meta.pk
+        else:
+            field = queryset.model._meta.get_field(name)
+        if value is None or isinstance(value, (dict, list)):
+            raise ValueError(name)
+        value = field.to_python(value)
+        field.run_validators(value)
+        return value
+
+    def encode_cursor(self, obj, reverse):
+        value = getattr(obj, self.field)
+        if isinstance(value, (date, datetime)):
+            value = value.isoformat()
+        elif value is not None and not isinstance(value, (int, float, str)):
+            value = str(value)
+        payload = json.dumps([value, obj.pk, int(reverse)], separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class CatalogPagination(PageNumberPagination):
+    """
+    Page number pagination with an opt-in keyset mode.
+
+    Clients switch to keyset pagination with `?pagination=cursor` and then
+    follow the `next`/`previous` links, which carry a `cursor` parameter.
+    """
+    mode_query_param = 'pagination'
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if (request.query_params.get(self.mode_query_param) == 'cursor' or
+                self.keyset_class.cursor_query_param in request.query_params):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
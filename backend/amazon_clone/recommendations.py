@@ -0,0 +1,323 @@
+import math
+import os
+from collections import Counter
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from scipy import sparse
+
+from .models import Order, OrderItem, Product, ProductRelation
+from .search import specification_text, tokenize
+
+
+BOUGHT_TOGETHER = 'bought_together'
+SIMILAR = 'similar'
+
+# Orders in these states never turn into purchases
+EXCLUDED_ORDER_STATUSES = Order.UNSOLD_STATUSES
+
+# Term frequency multipliers of each product field in the TF-IDF vectors
+SIMILARITY_FIELD_WEIGHTS = {'title': 3, 'specifications': 2, 'description': 1}
+
+
+def recommendations_path(name):
+    return os.path.join(settings.RECOMMENDATIONS_ROOT, name)
+
+
+def save_arrays(path, **arrays):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write next to the target and swap it in, so a crash never leaves half a file
+    tmp_path = f'{path}.tmp.npz'
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def top_neighbors(matrix, rows, k, scale=None, exclude_self=True, offset=0):
+    """
+    Yield (row, [(column, score), ...]) with the `k` best scoring columns of
+    each CSR row in `rows`. Scores are the stored values, multiplied by
+    `scale[row]` when given. Row i is column i + `offset` of the matrix.
+    """
+    for row in rows:
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        columns = matrix.indices[start:end]
+        scores = matrix.data[start:end].astype(np.float64)
+        if exclude_self:
+            keep = columns != row + offset
+            columns, scores = columns[keep], scores[keep]
+        if scale is not None:
+            scores = scores * scale[row]
+        if len(scores) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            columns, scores = columns[best], scores[best]
+        # Highest score first, ties broken by the lower product id
+        order = np.lexsort((columns, -scores))
+        yield int(row), [(int(columns[i]), float(scores[i])) for i in order]
+
+
+class CoPurchaseMatrix:
+    """
+    Sparse product x product matrix counting the orders that contain both.
+
+    The diagonal holds the number of orders containing each product. The
+    matrix is saved with the id of the last order folded into it, so each
+    update only reads the order items of newer orders.
+    """
+    filename = 'bought_together.npz'
+
+    def __init__(self, counts=None, last_order_id=0):
+        self.counts = counts if counts is not None else sparse.csr_matrix((0, 0), dtype=np.int32)
+        self.last_order_id = last_order_id
+
+    @classmethod
+    def load(cls, path=None):
+        """Saved matrix, or None when there is no saved state"""
+        path = path or recommendations_path(cls.filename)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as state:
+            counts = sparse.csr_matrix(
+                (state['data'], state['indices'], state['indptr']), shape=tuple(state['shape'])
+            )
+            return cls(counts, int(state['last_order_id']))
+
+    def save(self, path=None):
+        save_arrays(
+            path or recommendations_path(self.filename),
+            data=self.counts.data, indices=self.counts.indices, indptr=self.counts.indptr,
+            shape=np.array(self.counts.shape), last_order_id=np.array(self.last_order_id),
+        )
+
+    def pending_items(self, settle_seconds=0):
+        """(order id, product id) rows of the orders not folded in yet"""
+        items = OrderItem.objects.filter(order_id__gt=self.last_order_id).exclude(
+            order__status__in=EXCLUDED_ORDER_STATUSES
+        )
+        if settle_seconds:
+            # Leave orders still being written, or committed out of id order, for the next run
+            items = items.filter(order__created_at__lte=timezone.now() - timedelta(seconds=settle_seconds))
+        return items.order_by('order_id').values_list('order_id', 'product_id')
+
+    def update(self, rows, chunk_size=50000):
+        """
+        Fold (order id, product id) rows, sorted by order id, into the counts.
+
+        Returns the ids of the products whose row of the matrix changed.
+        """
+        touched = set()
+        for order_ids, product_ids in self.order_chunks(rows, chunk_size):
+            touched.update(self.add_orders(order_ids, product_ids))
+            self.last_order_id = max(self.last_order_id, int(order_ids[-1]))
+        return sorted(touched)
+
+    @staticmethod
+    def order_chunks(rows, chunk_size):
+        """Split the rows in chunks of about `chunk_size` without splitting an order"""
+        order_ids, product_ids = [], []
+        for order_id, product_id in rows:
+            if len(order_ids) >= chunk_size and order_id != order_ids[-1]:
+                yield np.array(order_ids), np.array(product_ids)
+                order_ids, product_ids = [], []
+            order_ids.append(order_id)
+            product_ids.append(product_id)
+        if order_ids:
+            yield np.array(order_ids), np.array(product_ids)
+
+    def add_orders(self, order_ids, product_ids):
+        # Order x product incidence matrix; repeated lines of a product count once
+        _, order_index = np.unique(order_ids, return_inverse=True)
+        size = max(self.counts.shape[0], int(product_ids.max()) + 1)
+        incidence = sparse.csr_matrix(
+            (np.ones(len(product_ids), dtype=np.int32), (order_index, product_ids)),
+            shape=(int(order_index.max()) + 1, size)
+        )
+        incidence.data[:] = 1
+        co_purchases = (incidence.T @ incidence).tocsr()
+
+        counts = self.counts
+        if counts.shape[0] < size:
+            counts = counts.tocoo()
+            counts = sparse.csr_matrix((counts.data, (counts.row, counts.col)), shape=(size, size))
+        self.counts = (counts + co_purchases).tocsr()
+        return np.unique(product_ids).tolist()
+
+    def neighbors(self, product_ids, k, min_count=1):
+        """
+        Top-`k` bought-together products of each product in `product_ids`.
+
+        The score of j for i is the share of the orders containing i that
+        also contain j, which only depends on row i of the matrix.
+        """
+        counts = self.counts
+        if min_count > 1:
+            counts = counts.copy()
+            counts.data[counts.data < min_count] = 0
+            counts.eliminate_zeros()
+        orders = counts.diagonal().astype(np.float64)
+        scale = np.divide(1.0, orders, out=np.zeros_like(orders), where=orders > 0)
+        rows = [pk for pk in product_ids if pk < counts.shape[0]]
+        return dict(top_neighbors(counts, rows, k, scale=scale))
+
+
+def rebuild_bought_together(k=10, full=False, min_count=1, settle_seconds=300, chunk_size=50000):
+    """
+    Fold the orders placed since the last run into the co-purchase matrix
+    and refresh the bought-together relations of the products they touched.
+
+    Returns (orders folded in up to this id, products refreshed, relation rows written).
+    """
+    matrix = None if full else CoPurchaseMatrix.load()
+    if matrix is None:
+        full = True
+        matrix = CoPurchaseMatrix()
+
+    touched = matrix.update(matrix.pending_items(settle_seconds).iterator(chunk_size=chunk_size), chunk_size)
+    neighbors = matrix.neighbors(touched, k, min_count=min_count)
+
+    # Products deleted since their orders were placed cannot be related to
+    existing = set()
+    candidates = list(set(touched) | {pk for pairs in neighbors.values() for pk, _ in pairs})
+    for start in range(0, len(candidates), 1000):
+        existing.update(
+            Product.objects.filter(pk__in=candidates[start:start + 1000]).values_list('pk', flat=True)
+        )
+    neighbors = {
+        pk: [(related, score) for related, score in pairs if related in existing]
+        for pk, pairs in neighbors.items() if pk in existing
+    }
+
+    with transaction.atomic():
+        if full:
+            ProductRelation.objects.filter(kind=BOUGHT_TOGETHER).delete()
+        written = ProductRelation.replace_for(BOUGHT_TOGETHER, neighbors)
+    matrix.save()
+    return matrix.last_order_id, len(neighbors), written
+
+
+class ProductVectors:
+    """
+    L2-normalized TF-IDF vectors of products, one CSR row per product.
+
+    Terms are the folded tokens of the title, description and
+    specification values, with SIMILARITY_FIELD_WEIGHTS applied to the
+    term frequencies. Vectors are stored as float32 next to the product
+    and category ids of their rows.
+    """
+    filename = 'similar_products.npz'
+
+    def __init__(self, vectors, product_ids, category_ids, terms):
+        self.vectors = vectors
+        self.product_ids = product_ids
+        self.category_ids = category_ids
+        self.terms = terms
+
+    @staticmethod
+    def product_terms(product):
+        terms = Counter()
+        fields = {
+            'title': product.title,
+            'description': product.description,
+            'specifications': specification_text(product.specifications),
+        }
+        for field, text in fields.items():
+            for token in tokenize(text):
+                terms[token] += SIMILARITY_FIELD_WEIGHTS[field]
+        return terms
+
+    @classmethod
+    def build(cls, products, chunk_size=2000):
+        """
+        Vectorize `products`, a queryset read in chunks. Products without a
+        category are skipped, as neighbors are only searched within one.
+        """
+        vocabulary = {}
+        product_ids, category_ids = [], []
+        indptr, indices, data = [0], [], []
+        for product in products.iterator(chunk_size=chunk_size):
+            if product.category_id is None:
+                continue
+            for term, count in cls.product_terms(product).items():
+                indices.append(vocabulary.setdefault(term, len(vocabulary)))
+                # Sublinear term frequency so a repeated word cannot dominate
+                data.append(1.0 + math.log(count))
+            indptr.append(len(indices))
+            product_ids.append(product.pk)
+            category_ids.append(product.category_id)
+
+        vectors = sparse.csr_matrix(
+            (np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr)),
+            shape=(len(product_ids), len(vocabulary))
+        )
+        # Smoothed inverse document frequency, as in scikit-learn
+        document_frequency = np.bincount(vectors.indices, minlength=len(vocabulary))
+        idf = np.log((1 + len(product_ids)) / (1 + document_frequency)) + 1
+        vectors = vectors @ sparse.diags(idf.astype(np.float32))
+        norms = np.sqrt(vectors.multiply(vectors).sum(axis=1)).A1
+        vectors = sparse.diags(np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)) @ vectors
+
+        terms = np.array(sorted(vocabulary, key=vocabulary.get), dtype=str)
+        return cls(vectors.astype(np.float32).tocsr(), np.array(product_ids), np.array(category_ids), terms)
+
+    @classmethod
+    def load(cls, path=None):
+        """Saved vectors, or None when they have not been built"""
+        path = path or recommendations_path(cls.filename)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as state:
+            vectors = sparse.csr_matrix(
+                (state['data'], state['indices'], state['indptr']), shape=tuple(state['shape'])
+            )
+            return cls(vectors, state['product_ids'], state['category_ids'], state['terms'])
+
+    def save(self, path=None):
+        save_arrays(
+            path or recommendations_path(self.filename),
+            data=self.vectors.data, indices=self.vectors.indices, indptr=self.vectors.indptr,
+            shape=np.array(self.vectors.shape), product_ids=self.product_ids,
+            category_ids=self.category_ids, terms=self.terms,
+        )
+
+    def neighbors(self, k, block_size=512):
+        """
+        Top-`k` most similar products (cosine similarity) of every product,
+        among the products of the same category.
+
+        Similarities are computed a block of rows at a time, so memory is
+        bounded by block_size x category size.
+        """
+        neighbors = {}
+        for category_id in np.unique(self.category_ids):
+            rows = np.flatnonzero(self.category_ids == category_id)
+            vectors = self.vectors[rows]
+            candidates = vectors.T.tocsc()
+            for start in range(0, len(rows), block_size):
+                similarity = (vectors[start:start + block_size] @ candidates).tocsr()
+                similarity.eliminate_zeros()
+                for row, pairs in top_neighbors(similarity, range(similarity.shape[0]), k, offset=start):
+                    neighbors[int(self.product_ids[rows[start + row]])] = [
+                        (int(self.product_ids[rows[column]]), score) for column, score in pairs
+                    ]
+        return neighbors
+
+
+def rebuild_similar_products(k=10, chunk_size=2000):
+    """
+    Vectorize every approved, categorized product, save the vectors and
+    replace the similar-product relations.
+
+    Returns (products vectorized, relation rows written).
+    """
+    products = Product.objects.approved().filter(category__isnull=False).only(
+        'id', 'category_id', 'title', 'description', 'specifications'
+    ).order_by('pk')
+    vectors = ProductVectors.build(products, chunk_size=chunk_size)
+    neighbors = vectors.neighbors(k)
+    with transaction.atomic():
+        ProductRelation.objects.filter(kind=SIMILAR).delete()
+        written = ProductRelation.replace_for(SIMILAR, neighbors)
+    vectors.save()
+    return len(vectors.product_ids), written
@@ -0,0 +1,295 @@
+import math
+import re
+import unicodedata
+
+from django.db import connection as default_connection
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+from rest_framework.settings import api_settings
+
+
+SQLITE_TABLE = 'amazon_clone_product_fts'
+SQLITE_TRIGRAM_TABLE = 'amazon_clone_product_trigram'
+POSTGRES_TABLE = 'amazon_clone_product_search'
+POSTGRES_TRIGRAM_INDEX = 'amazon_clone_product_search_text_trgm'
+
+# Product fields whose change affects the index (search_text follows
+# title and description)
+INDEXED_FIELDS = {'title', 'description', 'specifications', 'search_text'}
+
+# Share of the query's trigrams a product must contain to match a fuzzy
+# search; pg_trgm's default word_similarity_threshold
+FUZZY_THRESHOLD = 0.6
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fold_text(value):
+    """Lowercase text and strip accents so 'Electrónica' matches 'electronica'"""
+    if not value:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', str(value))
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokenize(value):
+    return TOKEN_RE.findall(fold_text(value))
+
+
+def trigrams(value):
+    """pg_trgm style trigrams of each word, padded with two spaces before and one after"""
+    grams = set()
+    for token in tokenize(value):
+        padded = f'  {token} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def specification_text(specifications):
+    """Flatten the values of a specifications JSON object into plain text"""
+    values = []
+    stack = [specifications]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+        elif item is not None:
+            values.append(str(item))
+    return ' '.join(reversed(values))
+
+
+def product_document(product):
+    """Folded (title, description, specifications) text indexed for a product"""
+    return (
+        fold_text(product.title),
+        fold_text(product.description),
+        fold_text(specification_text(product.specifications)),
+    )
+
+
+class SQLiteSearchBackend:
+    """FTS5 virtual table keyed on the product id (rowid)"""
+    table = SQLITE_TABLE
+
+    trigram_table = SQLITE_TRIGRAM_TABLE
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def index(self, products):
+        products = list(products)
+        self.index_fulltext(products)
+        self.index_trigrams(products)
+
+    def index_fulltext(self, products):
+        rows = [(product.pk, *product_document(product)) for product in products]
+        if not rows:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows]
+            )
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, title, description, specifications) '
+                f'VALUES (%s, %s, %s, %s)',
+                rows
+            )
+
+    def index_trigrams(self, products):
+        """Side table of (trigram, product id) rows, the SQLite stand-in for pg_trgm"""
+        if not products:
+            return
+        rows = [(gram, product.pk) for product in products for gram in trigrams(product.search_text)]
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {self.trigram_table} WHERE product_id = %s',
+                [(product.pk,) for product in products]
+            )
+            cursor.executemany(
+                f'INSERT INTO {self.trigram_table} (trigram, product_id) VALUES (%s, %s)', rows
+            )
+
+    def remove(self, product_ids):
+        product_ids = [(pk,) for pk in product_ids]
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', product_ids)
+            cursor.executemany(f'DELETE FROM {self.trigram_table} WHERE product_id = %s', product_ids)
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(f'DELETE FROM {self.trigram_table}')
+
+    def build_query(self, tokens):
+        # Every token must match, the last one as a prefix for search-as-you-type
+        terms = [f'"{token}"' for token in tokens]
+        terms[-1] += '*'
+        return ' '.join(terms)
+
+    def search(self, queryset, tokens):
+        query = self.build_query(tokens)
+        product_table = queryset.model._meta.db_table
+        # bm25() is lower for better matches; title outweighs specifications and description
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', [query])
+        ).annotate(
+            search_rank=RawSQL(
+                f'SELECT -bm25({self.table}, 10.0, 1.0, 4.0) FROM {self.table} '
+                f'WHERE {self.table} MATCH %s AND rowid = {product_table}.id',
+                [query],
+                output_field=FloatField(),
+            )
+        )
+
+    def fuzzy_search(self, queryset, text):
+        grams = sorted(trigrams(text))
+        needed = math.ceil(FUZZY_THRESHOLD * len(grams))
+        placeholders = ', '.join(['%s'] * len(grams))
+        product_table = queryset.model._meta.db_table
+        # Matching products are found through the (trigram, product_id)
+        # primary key and ranked by the share of query trigrams they contain
+        return queryset.filter(
+            pk__in=RawSQL(
+                f'SELECT product_id FROM {self.trigram_table} WHERE trigram IN ({placeholders}) '
+                f'GROUP BY product_id HAVING COUNT(*) >= %s',
+                [*grams, needed]
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                f'SELECT COUNT(*) * 1.0 / %s FROM {self.trigram_table} '
+                f'WHERE trigram IN ({placeholders}) AND product_id = {product_table}.id',
+                [len(grams), *grams],
+                output_field=FloatField(),
+            )
+        )
+
+
+class PostgresSearchBackend:
+    """Side table holding a weighted tsvector per product, with a GIN index"""
+    table = POSTGRES_TABLE
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def index(self, products):
+        rows = [(product.pk, *product_document(product)) for product in products]
+        if not rows:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {self.table} (product_id, document) VALUES (%s, "
+                f"setweight(to_tsvector('simple', %s), 'A') || "
+                f"setweight(to_tsvector('simple', %s), 'C') || "
+                f"setweight(to_tsvector('simple', %s), 'B')) "
+                f"ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+                rows
+            )
+
+    # search_text lives on the product row, where the pg_trgm index follows it
+    index_fulltext = index
+
+    def remove(self, product_ids):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.table} WHERE product_id = ANY(%s)', [list(product_ids)]
+            )
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {self.table}')
+
+    def build_query(self, tokens):
+        terms = list(tokens)
+        terms[-1] += ':*'
+        return ' & '.join(terms)
+
+    def search(self, queryset, tokens):
+        query = self.build_query(tokens)
+        product_table = queryset.model._meta.db_table
+        return queryset.filter(
+            pk__in=RawSQL(
+                f"SELECT product_id FROM {self.table} "
+                f"WHERE document @@ to_tsquery('simple', %s)",
+                [query]
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                f"SELECT ts_rank(document, to_tsquery('simple', %s)) FROM {self.table} "
+                f"WHERE product_id = {product_table}.id",
+                [query],
+                output_field=FloatField(),
+            )
+        )
+
+    def fuzzy_search(self, queryset, text):
+        text = ' '.join(tokenize(text))
+        search_text = f'{queryset.model._meta.db_table}.search_text'
+        # `<%` is true when word_similarity() reaches pg_trgm.word_similarity_threshold
+        # and is answered by the GIN trigram index
+        return queryset.filter(
+            RawSQL(f'%s <%% {search_text}', [text], output_field=BooleanField())
+        ).annotate(
+            search_rank=RawSQL(f'word_similarity(%s, {search_text})', [text], output_field=FloatField())
+        )
+
+
+SEARCH_BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend(connection=None):
+    """Full-text backend for the database vendor, or None when unsupported"""
+    connection = connection or default_connection
+    backend_class = SEARCH_BACKENDS.get(connection.vendor)
+    if backend_class is None:
+        return None
+    return backend_class(connection)
+
+
+def index_products(products):
+    backend = get_search_backend()
+    if backend is not None:
+        backend.index(products)
+
+
+def remove_products(product_ids):
+    backend = get_search_backend()
+    if backend is not None:
+        backend.remove(product_ids)
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    Ranked full-text search for `?search=`, typo tolerant with `&fuzzy=1`.
+
+    Fuzzy searches match the trigrams of the folded title and description
+    instead of whole words. Results are ordered by relevance unless an
+    explicit `?ordering=` is given, so this backend must run after
+    OrderingFilter. Databases without a search backend fall back to
+    substring matching on the folded search_text column.
+    """
+    fuzzy_param = 'fuzzy'
+
+    def filter_queryset(self, request, queryset, view):
+        tokens = tokenize(request.query_params.get(self.search_param, ''))
+        if not tokens:
+            return queryset
+
+        backend = get_search_backend()
+        if backend is None:
+            for token in tokens:
+                queryset = queryset.filter(search_text__contains=token)
+            return queryset
+
+        if request.query_params.get(self.fuzzy_param) in ('1', 'true'):
+            queryset = backend.fuzzy_search(queryset, ' '.join(tokens))
+        else:
+            queryset = backend.search(queryset, tokens)
+        if not request.query_params.get(api_settings.ORDERING_PARAM):
+            queryset = queryset.order_by('-search_rank', '-pk')
+        return queryset
@@ -1,11 +1,126 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
+from django.db import models, transaction
+from django.db.models import prefetch_related_objects
+from .categories import get_category_tree
 from .models import (
     User, Category, Product, ProductImage, Order, OrderItem,
-    Review, Wishlist, Cart, CartItem
+    Review, Wishlist, Cart, CartItem, load_primary_images
 )
 
 
+class SparseFieldsMixin:
+    """
+    Renders only the fields named in `?fields=id,title,...` on GET requests.
+
+    Only the top-level serializer is pruned; nested serializers render in
+    full. Unknown field names are rejected with a 400. `narrow_queryset()`
+    loads just the model columns the rendered fields read, so views can
+    skip large columns nobody asked for.
+    """
+    fields_query_param = 'fields'
+    # Model fields read by serializer fields that are not model fields
+    # themselves, such as properties; fields absent here and from the model
+    # cannot be narrowed and load the whole row
+    field_sources = {}
+    # Columns skipped when no fields are requested, because no field reads them
+    unused_columns = ()
+
+    @classmethod
+    def requested_fields(cls, request):
+        if request is None or request.method != 'GET':
+            return None
+        value = request.query_params.get(cls.fields_query_param)
+        if not value:
+            return None
+        requested = {name.strip() for name in value.split(',') if name.strip()}
+        unknown = requested - set(cls.Meta.fields)
+        if unknown:
+            raise serializers.ValidationError(
+                {cls.fields_query_param: f"Unknown fields: {', '.join(sorted(unknown))}"}
+            )
+        return requested
+
+    def get_fields(self):
+        fields = super().get_fields()
+        root = self.parent.parent if isinstance(self.parent, serializers.ListSerializer) else self.parent
+        requested = self.requested_fields(self.context.get('request')) if root is None else None
+        if requested is not None:
+            fields = {name: field for name, field in fields.items() if name in requested}
+        return fields
+
+    @classmethod
+    def model_fields_for(cls, requested):
+        """Model field paths the requested fields read, or None when they cannot be narrowed"""
+        model_fields = {field.name for field in cls.Meta.model._meta.concrete_fields}
+        declared = cls._declared_fields
+        paths = {'id'}
+        for name in requested & set(cls.Meta.fields):
+            if name in cls.field_sources:
+                paths.update(cls.field_sources[name])
+                continue
+            field = declared.get(name)
+            source = getattr(field, 'source', None) or name
+            if source.split('.')[0] not in model_fields:
+                return None
+            paths.add(source.replace('.', '__'))
+        return paths
+
+    @classmethod
+    def narrow_queryset(cls, queryset, request):
+        """Load only the columns read by the fields this request renders"""
+        requested = cls.requested_fields(request)
+        if requested is None:
+            return queryset.defer(*cls.unused_columns) if cls.unused_columns else queryset
+        paths = cls.model_fields_for(requested)
+        if paths is None:
+            return queryset
+        # Follow only the relations the rendered fields read
+        related = {path.split('__')[0] for path in paths if '__' in path}
+        related_fields = {
+            field.name for field in cls.Meta.model._meta.concrete_fields if field.is_relation
+        }
+        related.update(paths & related_fields & set(queryset.query.select_related or {}))
+        queryset = queryset.select_related(None)
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset.only(*paths)
+
+
+class PrimaryImageListSerializer(serializers.ListSerializer):
+    """List serializer that batch-loads the primary image of every row"""
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        items = list(iterable)
+        if self.child.image_field not in self.child.fields:
+            return super().to_representation(items)
+        product_field = self.child.image_product_field
+        if product_field:
+            prefetch_related_objects(items, product_field)
+            products = [getattr(item, product_field) for item in items]
+        else:
+            products = items
+        load_primary_images(products)
+        return super().to_representation(items)
+
+
+class PrimaryImageMixin:
+    """Renders a product's primary image as an absolute URL"""
+    # Attribute holding the product on the serialized instance, None for products
+    image_product_field = None
+    # Serializer field rendering the image
+    image_field = 'primary_image'
+
+    def build_primary_image_url(self, product):
+        primary = product.primary_image
+        if primary:
+            request = self.context.get('request')
+            if request:
+                return request.build_absolute_uri(primary.image.url)
+        return None
+
+
 class UserSerializer(serializers.ModelSerializer):
     """Serializer for User model"""
     password = serializers.CharField(write_only=True, required=False)
@@ -85,8 +200,13 @@ class CategorySerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'slug']
 
     def get_subcategories(self, obj):
-        if obj.subcategories.exists():
-            return CategorySerializer(obj.subcategories.all(), many=True).data
+        # Children come from the cached category tree instead of a query per node
+        tree = self.context.get('category_tree') or get_category_tree()
+        subcategories = tree.children.get(obj.pk, [])
+        if subcategories:
+            return CategorySerializer(
+                subcategories, many=True, context={'category_tree': tree}
+            ).data
         return []
 
 
@@ -98,7 +218,7 @@ class ProductImageSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class ProductListSerializer(serializers.ModelSerializer):
+class ProductListSerializer(SparseFieldsMixin, PrimaryImageMixin, serializers.ModelSerializer):
     """Serializer for Product list view"""
     seller_name = serializers.CharField(source='seller.username', read_only=True)
     category_name = serializers.CharField(source='category.name', read_only=True)
@@ -116,17 +236,21 @@ class ProductListSerializer(serializers.ModelSerializer):
             'seller_name', 'category_name', 'primary_image', 'average_rating',
             'review_count', 'created_at'
         ]
+        list_serializer_class = PrimaryImageListSerializer
+
+    field_sources = {
+        'final_price': ['price', 'discount_price'],
+        'discount_percentage': ['price', 'discount_price'],
+        'review_count': ['rating_count'],
+        'primary_image': [],
+    }
+    unused_columns = ('description', 'specifications', 'search_text')
 
     def get_primary_image(self, obj):
-        primary = obj.images.filter(is_primary=True).first()
-        if primary:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(primary.image.url)
-        return None
+        return self.build_primary_image_url(obj)
 
 
-class ProductDetailSerializer(serializers.ModelSerializer):
+class ProductDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Product detail view"""
     seller = UserSerializer(read_only=True)
     category = CategorySerializer(read_only=True)
@@ -135,6 +259,7 @@ class ProductDetailSerializer(serializers.ModelSerializer):
     discount_percentage = serializers.IntegerField(read_only=True)
     average_rating = serializers.FloatField(read_only=True)
     review_count = serializers.IntegerField(read_only=True)
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
 
     class Meta:
         model = Product
@@ -142,10 +267,19 @@ class ProductDetailSerializer(serializers.ModelSerializer):
             'id', 'seller', 'category', 'title', 'slug', 'description',
             'specifications', 'price', 'discount_price', 'final_price',
             'discount_percentage', 'stock', 'is_active', 'is_featured',
-            'images', 'average_rating', 'review_count', 'created_at', 'updated_at'
+            'images', 'average_rating', 'review_count', 'rating_histogram',
+            'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'slug', 'created_at', 'updated_at']
 
+    field_sources = {
+        'final_price': ['price', 'discount_price'],
+        'discount_percentage': ['price', 'discount_price'],
+        'images': [],
+        'review_count': ['rating_count'],
+        'rating_histogram': ['rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5'],
+    }
+
 
 class ProductCreateUpdateSerializer(serializers.ModelSerializer):
     """Serializer for creating/updating products"""
@@ -213,7 +347,7 @@ class ProductCreateUpdateSerializer(serializers.ModelSerializer):
         return instance
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Review model"""
     buyer_name = serializers.CharField(source='buyer.username', read_only=True)
     product_title = serializers.CharField(source='product.title', read_only=True)
@@ -240,11 +374,13 @@ class ReviewSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(PrimaryImageMixin, serializers.ModelSerializer):
     """Serializer for OrderItem model"""
     product_title = serializers.CharField(source='product.title', read_only=True)
     product_image = serializers.SerializerMethodField()
     subtotal = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    image_product_field = 'product'
+    image_field = 'product_image'
 
     class Meta:
         model = OrderItem
@@ -253,17 +389,13 @@ class OrderItemSerializer(serializers.ModelSerializer):
             'quantity', 'price', 'subtotal', 'seller'
         ]
         read_only_fields = ['id', 'seller']
+        list_serializer_class = PrimaryImageListSerializer
 
     def get_product_image(self, obj):
-        primary = obj.product.images.filter(is_primary=True).first()
-        if primary:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(primary.image.url)
-        return None
+        return self.build_primary_image_url(obj.product)
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Order model"""
     items = OrderItemSerializer(many=True, read_only=True)
     buyer_name = serializers.CharField(source='buyer.username', read_only=True)
@@ -277,6 +409,8 @@ class OrderSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'order_number', 'buyer', 'created_at', 'updated_at']
 
+    field_sources = {'items': []}
+
 
 class OrderCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating orders"""
@@ -291,34 +425,40 @@ class OrderCreateSerializer(serializers.ModelSerializer):
         if not cart or not cart.items.exists():
             raise serializers.ValidationError("Cart is empty")
 
-        # Create order
-        order = Order.objects.create(
-            buyer=user,
-            total_amount=cart.total_amount,
-            **validated_data
-        )
-
-        # Create order items from cart
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                seller=cart_item.product.seller,
-                quantity=cart_item.quantity,
-                price=cart_item.product.final_price
+        # Order, stock and sales counters change together or not at all
+        with transaction.atomic():
+            # Create order
+            order = Order.objects.create(
+                buyer=user,
+                total_amount=cart.total_amount,
+                **validated_data
             )
-            # Update stock
-            product = cart_item.product
-            product.stock -= cart_item.quantity
-            product.save()
 
-        # Clear cart
-        cart.items.all().delete()
+            # Create order items from cart
+            sold = {}
+            for cart_item in cart.items.all():
+                OrderItem.objects.create(
+                    order=order,
+                    product=cart_item.product,
+                    seller=cart_item.product.seller,
+                    quantity=cart_item.quantity,
+                    price=cart_item.product.final_price
+                )
+                # Update stock; only that column is written so the sales counters
+                # updated below are not overwritten with stale values
+                product = cart_item.product
+                product.stock -= cart_item.quantity
+                product.save(update_fields=['stock'])
+                sold[product.pk] = sold.get(product.pk, 0) + cart_item.quantity
+            Product.record_sales(sold)
+
+            # Clear cart
+            cart.items.all().delete()
 
         return order
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(PrimaryImageMixin, serializers.ModelSerializer):
     """Serializer for CartItem model"""
     product_title = serializers.CharField(source='product.title', read_only=True)
     product_price = serializers.DecimalField(
@@ -330,6 +470,8 @@ class CartItemSerializer(serializers.ModelSerializer):
     product_image = serializers.SerializerMethodField()
     product_stock = serializers.IntegerField(source='product.stock', read_only=True)
     subtotal = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    image_product_field = 'product'
+    image_field = 'product_image'
 
     class Meta:
         model = CartItem
@@ -338,14 +480,10 @@ class CartItemSerializer(serializers.ModelSerializer):
             'product_image', 'product_stock', 'quantity', 'subtotal'
         ]
         read_only_fields = ['id']
+        list_serializer_class = PrimaryImageListSerializer
 
     def get_product_image(self, obj):
-        primary = obj.product.images.filter(is_primary=True).first()
-        if primary:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(primary.image.url)
-        return None
+        return self.build_primary_image_url(obj.product)
 
     def validate_quantity(self, value):
         if value < 1:
@@ -0,0 +1,86 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal, receiver
+
+from .cache import CATEGORIES, PRODUCTS, bump_catalog_versions_on_commit, product_scope
+from .categories import invalidate_category_tree
+from .models import Category, Product, ProductAttribute, ProductImage, Review
+from .search import INDEXED_FIELDS, index_products, remove_products
+from .suggest import (
+    SUGGESTION_FIELDS, remove_product_suggestions, update_category_suggestions,
+    update_product_suggestions,
+)
+
+
+# Sent with `products` after a batch of products is written with
+# bulk_create, which does not send post_save
+products_imported = Signal()
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Keep the full-text index in sync with the saved product"""
+    if raw or (update_fields is not None and not INDEXED_FIELDS.intersection(update_fields)):
+        return
+    index_products([instance])
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_attributes(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Keep the specification attribute index in sync with the saved product"""
+    if raw or (update_fields is not None and 'specifications' not in update_fields):
+        return
+    ProductAttribute.refresh_for([instance])
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_suggestions(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Keep the typeahead index in sync with the saved product, once it is committed"""
+    if raw or (update_fields is not None and not SUGGESTION_FIELDS.intersection(update_fields)):
+        return
+    transaction.on_commit(partial(update_product_suggestions, [instance]))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    """Drop a deleted product from the full-text and typeahead indexes"""
+    remove_products([instance.pk])
+    transaction.on_commit(partial(remove_product_suggestions, instance.pk))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, **kwargs):
+    """Drop the cached category tree and responses showing categories"""
+    # After the commit, so the tree is never rebuilt from uncommitted or
+    # half-written paths
+    transaction.on_commit(invalidate_category_tree)
+    transaction.on_commit(update_category_suggestions)
+    bump_catalog_versions_on_commit(CATEGORIES, PRODUCTS)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+    """Invalidate cached product lists and this product's detail"""
+    bump_catalog_versions_on_commit(PRODUCTS, product_scope(instance.pk))
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def product_related_changed(sender, instance, **kwargs):
+    """Images and reviews are shown on product lists and details"""
+    bump_catalog_versions_on_commit(PRODUCTS, product_scope(instance.product_id))
+
+
+@receiver(products_imported)
+def index_imported_products(sender, products, **kwargs):
+    """Index bulk-created products and invalidate cached product lists"""
+    index_products(products)
+    ProductAttribute.refresh_for(products)
+    transaction.on_commit(partial(update_product_suggestions, products))
+    bump_catalog_versions_on_commit(PRODUCTS)
@@ -0,0 +1,365 @@
+import heapq
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Q
+
+from .cache import bump_catalog_versions, get_catalog_versions
+from .models import Category, Product
+from .search import fold_text
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_SCOPE = 'suggest'
+SUGGESTION_LIMIT = 10
+
+# Only this many characters of a title are indexed from each word start
+MAX_PREFIX_LENGTH = 40
+
+# How often a process checks whether another process changed the index,
+# and the minimum time between the rebuilds that follow
+VERSION_CHECK_INTERVAL = 1
+REBUILD_INTERVAL = 60
+
+# Age after which the index is rebuilt whatever the version says; the only
+# way changes from other processes arrive when the cache is not shared
+MAX_INDEX_AGE = 300
+
+# Product fields whose change affects the suggestions
+SUGGESTION_FIELDS = {'title', 'slug', 'is_approved', 'is_active', 'popularity_score'}
+
+
+def suggestion_popularity(product):
+    return product.popularity_score
+
+
+def prefixes(text):
+    """Folded text from each word start on, so 'Galaxy' also finds 'Samsung Galaxy'"""
+    folded = ' '.join(fold_text(text).split())
+    starts = [0] + [i + 1 for i, char in enumerate(folded) if char == ' ']
+    return {folded[start:start + MAX_PREFIX_LENGTH] for start in starts if folded[start:]}
+
+
+class _Node:
+    __slots__ = ('children', 'entries', 'bucket', 'top')
+
+    def __init__(self, top=None, bucket=None):
+        self.children = {}
+        # Keys whose indexed text ends at this node
+        self.entries = set()
+        # Leaves hold (rest of the text, key) pairs instead of children
+        self.bucket = bucket
+        # Best SUGGESTION_LIMIT keys below this node, None when it must be recomputed
+        self.top = top
+
+
+class SuggestIndex:
+    """
+    In-memory prefix trie over approved product titles and category names.
+
+    Each node keeps the keys of its most popular suggestions, so a lookup
+    is a walk down the query's characters. Unique title endings are kept in
+    small leaf buckets that only split into child nodes once they fill up,
+    which keeps the node count close to the number of shared prefixes.
+    Removing a suggestion only marks the nodes that listed it, which are
+    recomputed from their children on the next lookup. Products sharing a
+    title are one suggestion, pointing at the most popular of them.
+    """
+    bucket_size = 32
+
+    def __init__(self, limit=SUGGESTION_LIMIT):
+        self.limit = limit
+        self.root = _Node(top=[], bucket=[])
+        self.suggestions = {}
+        self.titles = {}
+        self.products = {}
+        self.lock = threading.RLock()
+
+    @classmethod
+    def build(cls):
+        index = cls()
+        # Skip ranking while loading; every node is ranked once at the end
+        index.root.top = None
+        products = Product.objects.approved().only(
+            'id', 'title', 'slug', 'is_approved', 'is_active', 'popularity_score'
+        )
+        for product in products.iterator(chunk_size=2000):
+            index.update_product(product)
+        index.update_categories()
+        index.top(index.root)
+        return index
+
+    def sort_key(self, key):
+        suggestion = self.suggestions[key]
+        return -suggestion['score'], suggestion['text'], key
+
+    def rank(self, keys):
+        return heapq.nsmallest(self.limit, keys, key=self.sort_key)
+
+    def insert(self, key):
+        rank = self.sort_key(key)
+        for text in prefixes(self.suggestions[key]['text']):
+            node = self.root
+            for depth in range(len(text) + 1):
+                top = node.top
+                if top is not None and key not in top and (
+                        len(top) < self.limit or rank < self.sort_key(top[-1])):
+                    top.append(key)
+                    top.sort(key=self.sort_key)
+                    del top[self.limit:]
+                if node.bucket is not None:
+                    node.bucket.append((text[depth:], key))
+                    if len(node.bucket) > self.bucket_size:
+                        self.split(node)
+                    break
+                if depth == len(text):
+                    node.entries.add(key)
+                    break
+                child = node.children.get(text[depth])
+                if child is None:
+                    child = node.children[text[depth]] = _Node(top=[], bucket=[])
+                node = child
+
+    def split(self, node):
+        """Turn a full leaf into an inner node with one leaf per next character"""
+        pairs, node.bucket = node.bucket, None
+        for rest, key in pairs:
+            if not rest:
+                node.entries.add(key)
+                continue
+            child = node.children.get(rest[0])
+            if child is None:
+                child = node.children[rest[0]] = _Node(bucket=[])
+            child.bucket.append((rest[1:], key))
+        for child in node.children.values():
+            if child.bucket is not None and len(child.bucket) > self.bucket_size:
+                self.split(child)
+
+    def remove(self, key):
+        for text in prefixes(self.suggestions[key]['text']):
+            node = self.root
+            for depth in range(len(text) + 1):
+                if node.top is not None and key in node.top:
+                    node.top = None
+                if node.bucket is not None:
+                    if (text[depth:], key) in node.bucket:
+                        node.bucket.remove((text[depth:], key))
+                    break
+                if depth == len(text):
+                    node.entries.discard(key)
+                    break
+                node = node.children.get(text[depth])
+                if node is None:
+                    break
+
+    def top(self, node):
+        if node.top is None:
+            keys = set(node.entries)
+            if node.bucket is not None:
+                keys.update(key for _, key in node.bucket)
+            for child in node.children.values():
+                keys.update(self.top(child))
+            node.top = self.rank(keys)
+        return node.top
+
+    def set_suggestion(self, key, suggestion):
+        """Add, replace (suggestion given) or drop (None) the suggestion under `key`"""
+        if key in self.suggestions:
+            self.remove(key)
+            del self.suggestions[key]
+        if suggestion is not None:
+            self.suggestions[key] = suggestion
+            self.insert(key)
+
+    def update_title(self, title):
+        products = self.titles.get(title)
+        suggestion = None
+        if products:
+            pk = min(products, key=lambda pk: (-products[pk]['score'], pk))
+            suggestion = dict(products[pk], type='product', id=pk)
+        self.set_suggestion(('product', title), suggestion)
+
+    def update_product(self, product):
+        """Index, reindex or (when no longer approved) drop a product"""
+        with self.lock:
+            previous = self.products.pop(product.pk, None)
+            if previous is not None:
+                del self.titles[previous][product.pk]
+            if product.is_approved and product.is_active and product.title:
+                title = fold_text(product.title)
+                self.products[product.pk] = title
+                self.titles.setdefault(title, {})[product.pk] = {
+                    'text': product.title,
+                    'slug': product.slug,
+                    'score': suggestion_popularity(product),
+                }
+                self.update_title(title)
+            if previous is not None and previous != self.products.get(product.pk):
+                self.update_title(previous)
+
+    def remove_product(self, product_id):
+        with self.lock:
+            previous = self.products.pop(product_id, None)
+            if previous is not None:
+                del self.titles[previous][product_id]
+                self.update_title(previous)
+
+    def update_categories(self):
+        """Reindex every category, ranked by its number of approved products"""
+        categories = Category.objects.annotate(
+            product_count=Count('products', filter=Q(products__is_approved=True, products__is_active=True))
+        ).only('id', 'name', 'slug')
+        with self.lock:
+            for key in [key for key in self.suggestions if key[0] == 'category']:
+                self.set_suggestion(key, None)
+            for category in categories:
+                self.set_suggestion(('category', category.pk), {
+                    'type': 'category',
+                    'id': category.pk,
+                    'text': category.name,
+                    'slug': category.slug,
+                    'score': category.product_count,
+                })
+
+    def suggest(self, query, limit=SUGGESTION_LIMIT):
+        query = ' '.join(fold_text(query).split())[:MAX_PREFIX_LENGTH]
+        if not query:
+            return []
+        with self.lock:
+            node = self.root
+            keys = None
+            for depth, char in enumerate(query):
+                if node.bucket is not None:
+                    rest = query[depth:]
+                    keys = self.rank({key for text, key in node.bucket if text.startswith(rest)})
+                    break
+                node = node.children.get(char)
+                if node is None:
+                    return []
+            if keys is None:
+                keys = self.top(node)
+            return [
+                {field: self.suggestions[key][field] for field in ('type', 'id', 'slug', 'text')}
+                for key in keys[:limit]
+            ]
+
+
+_index = None
+_index_version = None
+_checked_at = 0
+_built_at = 0
+_index_lock = threading.Lock()
+# Whether a background rebuild is running, and the changes made in this
+# process since it started reading, replayed onto its index before the
+# index is swapped in
+_rebuilding = False
+_pending_changes = []
+
+
+def get_suggest_index():
+    """
+    This process's index, built on first use.
+
+    Changes made in this process are applied to it incrementally by the
+    product and category signals. With a shared cache, changes made by
+    other processes are noticed through the cached suggest version and
+    picked up by a rebuild, at most every REBUILD_INTERVAL seconds. The
+    index is also rebuilt every MAX_INDEX_AGE seconds regardless, which is
+    how a per-process cache picks them up. Only the first build runs in
+    the request; later ones run in a background thread while requests keep
+    using the current index.
+    """
+    global _index, _index_version, _checked_at, _built_at, _rebuilding
+    now = time.monotonic()
+    if _index is not None and now - _checked_at < VERSION_CHECK_INTERVAL:
+        return _index
+    with _index_lock:
+        _checked_at = now
+        version = get_catalog_versions([SUGGEST_SCOPE])[0]
+        if _index is None:
+            _index = SuggestIndex.build()
+            _index_version = version
+            _built_at = now
+            return _index
+        age = now - _built_at
+        changed = settings.CATALOG_CACHE_SHARED and version != _index_version and age >= REBUILD_INTERVAL
+        if (changed or age >= MAX_INDEX_AGE) and not _rebuilding:
+            _rebuilding = True
+            _pending_changes.clear()
+            start_rebuild(version, now)
+        return _index
+
+
+def start_rebuild(version, now):
+    """Run rebuild_index in a background thread with its own database connection"""
+    def run():
+        try:
+            rebuild_index(version, now)
+        finally:
+            connection.close()
+    threading.Thread(target=run, name='suggest-index-rebuild', daemon=True).start()
+
+
+def rebuild_index(version, now):
+    """Build a fresh index and swap it in once it has caught up with this process's changes"""
+    global _index, _index_version, _built_at, _rebuilding
+    try:
+        index = SuggestIndex.build()
+    except Exception:
+        logger.exception('Rebuilding the suggest index failed')
+        index = None
+    while True:
+        with _index_lock:
+            changes = list(_pending_changes)
+            _pending_changes.clear()
+            if index is None or not changes:
+                if index is not None:
+                    _index = index
+                    _index_version = version
+                # Also after a failure, so the next attempt waits a full interval
+                _built_at = now
+                _rebuilding = False
+                return
+        for change in changes:
+            change(index)
+
+
+def apply_change(change):
+    """Apply a change made in this process to the index and to any rebuild in progress"""
+    with _index_lock:
+        index = _index
+        if _rebuilding:
+            _pending_changes.append(change)
+    if index is not None:
+        change(index)
+
+
+def suggestions_changed():
+    """Tell other processes their index is out of date, and keep ours current"""
+    global _index_version
+    before = get_catalog_versions([SUGGEST_SCOPE])[0]
+    bump_catalog_versions(SUGGEST_SCOPE)
+    # Only an index that was current before this change is current after it
+    if _index is not None and _index_version == before:
+        _index_version = get_catalog_versions([SUGGEST_SCOPE])[0]
+
+
+def update_product_suggestions(products):
+    def change(index):
+        for product in products:
+            index.update_product(product)
+    apply_change(change)
+    suggestions_changed()
+
+
+def remove_product_suggestions(product_id):
+    apply_change(lambda index: index.remove_product(product_id))
+    suggestions_changed()
+
+
+def update_category_suggestions():
+    apply_change(lambda index: index.update_categories())
+    suggestions_changed()
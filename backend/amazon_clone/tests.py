@@ -1,3 +1,1097 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import io
+import json
+import re
+import tempfile
+import uuid
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import brotli
+import msgpack
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models.signals import post_save
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import suggest
+from .catalog_io import CatalogImporter, read_rows
+from .categories import get_category_tree
+from .models import Category, Order, OrderItem, Product, ProductRelation, Review, User
+from .renderers import FastJSONRenderer, MessagePackRenderer
+from .serializers import ReviewSerializer
+from .views import BATCH_MAX_IDS, OrderViewSet, ReviewViewSet
+
+try:
+    from . import recommendations
+except ImportError:
+    recommendations = None
+
+
+# Plan lines of a full table scan, per database vendor
+FULL_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'^SCAN (?P<table>\w+)$'),
+    'postgresql': re.compile(r'Seq Scan on (?P<table>\w+)'),
+}
+
+# Tables small enough that reading them whole is the right plan
+SMALL_TABLES = {'amazon_clone_category', 'amazon_clone_user', 'authtoken_token'}
+
+
+class QueryPlanTests(TestCase):
+    """
+    The catalog's hot endpoints are served from indexes.
+
+    Each test requests an endpoint against a seeded catalog, EXPLAINs every
+    query it ran and fails when a plan reads a large table in full. Product
+    lists use keyset pagination, since page numbers need a COUNT(*) over
+    the whole matching catalog.
+    """
+    product_count = 20000
+    seller_count = 20
+    buyer_count = 20
+    order_count = 4000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sellers = User.objects.bulk_create([
+            User(username=f'seller{i}', password='!', role='seller', seller_approved=True)
+            for i in range(cls.seller_count)
+        ])
+        cls.buyers = User.objects.bulk_create([
+            User(username=f'buyer{i}', password='!', role='buyer') for i in range(cls.buyer_count)
+        ])
+        cls.categories = [Category.objects.create(name=f'Category {i}') for i in range(20)]
+        Product.objects.bulk_create([
+            Product(
+                seller=cls.sellers[i % cls.seller_count],
+                category=cls.categories[i % len(cls.categories)],
+                title=f'Product {i}',
+                slug=f'product-{i}',
+                description='Description',
+                price=10 + i % 90,
+                stock=10,
+                is_approved=i % 10 != 0,
+                is_featured=i % 50 == 0,
+            )
+            for i in range(cls.product_count)
+        ], batch_size=1000)
+        products = list(Product.objects.order_by('pk').only('id', 'seller_id'))
+        cls.product = products[1]
+
+        orders = Order.objects.bulk_create([
+            Order(
+                order_number=f'MS-{i:012d}',
+                buyer=cls.buyers[i % cls.buyer_count],
+                status=('pending', 'shipped', 'delivered')[i % 3],
+                total_amount=10,
+                shipping_address='Address',
+                shipping_phone='555',
+            )
+            for i in range(cls.order_count)
+        ], batch_size=1000)
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=orders[i % cls.order_count],
+                product=products[i * 7 % cls.product_count],
+                seller_id=products[i * 7 % cls.product_count].seller_id,
+                quantity=1,
+                price=10,
+            )
+            for i in range(cls.order_count * 2)
+        ], batch_size=1000)
+        Review.objects.bulk_create([
+            Review(product=product, buyer=buyer, rating=4, comment='Good')
+            for buyer in cls.buyers
+            for product in products[:1000]
+        ], batch_size=1000)
+
+        # Give the planner real statistics about the seeded tables
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        if connection.vendor not in FULL_SCAN_PATTERNS:
+            self.skipTest(f'No query plan check for {connection.vendor}')
+        # Cached responses would skip the queries under test
+        cache.clear()
+
+    def full_scans(self, sql):
+        """Large tables the plan of `sql` reads in full"""
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}')
+            plan = [row[-1] for row in cursor.fetchall()]
+        pattern = FULL_SCAN_PATTERNS[connection.vendor]
+        return [
+            line for line in plan
+            if (match := pattern.search(line)) and match['table'] not in SMALL_TABLES
+            and not match['table'].startswith('subquery')
+        ]
+
+    def assertIndexedQueries(self, client, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        selects = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('SELECT')]
+        # The endpoint must have read one of the large tables for the check to mean anything
+        self.assertTrue(any(
+            re.search(r'FROM "amazon_clone_(product|order|orderitem|review)"', sql) for sql in selects
+        ))
+        for sql in selects:
+            with self.subTest(sql=sql):
+                self.assertEqual(self.full_scans(sql), [])
+        return response
+
+    def test_product_list(self):
+        client = APIClient()
+        response = self.assertIndexedQueries(client, '/api/products/', {'pagination': 'cursor'})
+        self.assertIndexedQueries(client, response.json()['next'])
+
+    def test_product_list_by_category(self):
+        client = APIClient()
+        category = self.categories[3]
+        self.assertIndexedQueries(client, '/api/products/', {'pagination': 'cursor', 'category': category.pk})
+        response = self.assertIndexedQueries(
+            client, '/api/products/', {'pagination': 'cursor', 'category_tree': category.slug}
+        )
+        self.assertTrue(response.json()['results'])
+
+    def test_featured_products(self):
+        client = APIClient()
+        self.assertIndexedQueries(client, '/api/products/featured/')
+        self.assertIndexedQueries(client, '/api/products/', {'is_featured': 'true'})
+
+    def test_seller_products(self):
+        client = APIClient()
+        client.force_authenticate(self.sellers[3])
+        self.assertIndexedQueries(client, '/api/products/', {'seller': self.sellers[3].pk})
+
+    def test_seller_dashboard(self):
+        client = APIClient()
+        client.force_authenticate(self.sellers[3])
+        self.assertIndexedQueries(client, '/api/seller/dashboard/')
+
+    def test_seller_orders(self):
+        client = APIClient()
+        client.force_authenticate(self.sellers[3])
+        self.assertIndexedQueries(client, '/api/orders/')
+
+    def test_buyer_orders(self):
+        client = APIClient()
+        client.force_authenticate(self.buyers[3])
+        self.assertIndexedQueries(client, '/api/orders/')
+
+    def test_reviews_by_product(self):
+        self.assertIndexedQueries(APIClient(), '/api/reviews/', {'product': self.product.pk})
+
+
+class CatalogCacheTests(TestCase):
+    """Cached catalog responses, their invalidation and conditional requests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create(username='seller', role='seller', seller_approved=True)
+        cls.category = Category.objects.create(name='Phones')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def create_product(self, **fields):
+        fields = {
+            'seller': self.seller, 'category': self.category, 'title': 'Phone',
+            'description': 'A phone', 'price': 100, 'is_approved': True, **fields,
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(**fields)
+
+    def titles(self, response):
+        return [product['title'] for product in response.json()['results']]
+
+    def test_product_change_invalidates_cached_list(self):
+        product = self.create_product(title='Old title')
+        self.assertEqual(self.titles(self.client.get('/api/products/')), ['Old title'])
+
+        product.title = 'New title'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(self.titles(self.client.get('/api/products/')), ['New title'])
+
+    def test_versions_are_bumped_on_commit(self):
+        product = self.create_product(title='Old title')
+        self.client.get('/api/products/')
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            Product.objects.filter(pk=product.pk).update(title='New title')
+            product.save(update_fields=['stock'])
+            # Not committed yet, so the cached response is still current
+            self.assertEqual(self.titles(self.client.get('/api/products/')), ['Old title'])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.titles(self.client.get('/api/products/')), ['New title'])
+
+    def test_etag_and_not_modified(self):
+        product = self.create_product()
+        response = self.client.get(f'/api/products/{product.pk}/')
+        etag = response['ETag']
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        response = self.client.get(f'/api/products/{product.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        product.price = 90
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        response = self.client.get(f'/api/products/{product.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_featured_only_lists_approved_products(self):
+        self.create_product(title='Approved', is_featured=True)
+        self.create_product(title='Pending', is_featured=True, is_approved=False)
+        response = self.client.get('/api/products/featured/')
+        self.assertEqual([product['title'] for product in response.json()], ['Approved'])
+
+    def test_authenticated_responses_are_not_cached_for_the_public(self):
+        self.create_product(title='Pending', is_approved=False)
+        seller = APIClient()
+        seller.force_authenticate(self.seller)
+        self.assertEqual(self.titles(seller.get('/api/products/', {'seller': self.seller.pk})), ['Pending'])
+        self.assertEqual(self.titles(self.client.get('/api/products/', {'seller': self.seller.pk})), [])
+
+    @override_settings(CATALOG_CACHE_SHARED=False, CATALOG_CACHE_TIMEOUT=0)
+    def test_per_process_cache_expires_versions(self):
+        self.create_product()
+        first = self.client.get('/api/products/')['ETag']
+        self.assertNotEqual(self.client.get('/api/products/')['ETag'], first)
+
+
+class KeysetPaginationTests(TestCase):
+    """Walking ?pagination=cursor pages returns each product once, in order"""
+
+    @classmethod
+    def setUpTestData(cls):
+        seller = User.objects.create(username='seller', role='seller', seller_approved=True)
+        # Enough for three pages, with repeated prices and search ranks so the
+        # id tiebreak is exercised
+        for i in range(45):
+            Product.objects.create(
+                seller=seller, title=f'Phone {i}', description='phone ' * (i % 4 + 1),
+                price=100 + i % 3, is_approved=True,
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def walk(self, params):
+        pages = []
+        response = self.client.get('/api/products/', {**params, 'pagination': 'cursor'})
+        while True:
+            body = response.json()
+            pages.append([product['id'] for product in body['results']])
+            if not body['next']:
+                break
+            response = self.client.get(body['next'])
+        # And back again from the last page
+        previous = body['previous']
+        for page in reversed(pages[:-1]):
+            body = self.client.get(previous).json()
+            self.assertEqual([product['id'] for product in body['results']], page)
+            previous = body['previous']
+        self.assertIsNone(previous)
+        return [pk for page in pages for pk in page]
+
+    def numbered(self, params):
+        ids = []
+        for page in (1, 2, 3):
+            body = self.client.get('/api/products/', {**params, 'page': page}).json()
+            ids.extend(product['id'] for product in body['results'])
+        return ids
+
+    def test_pages_follow_ordering(self):
+        for params in ({}, {'ordering': 'price'}, {'ordering': '-price'}):
+            with self.subTest(**params):
+                ids = self.walk(params)
+                self.assertEqual(len(ids), 45)
+                self.assertEqual(ids, self.numbered(params))
+
+    def test_sparse_fields_keep_the_cursor_column(self):
+        for ordering in ('-created_at', 'price'):
+            with self.subTest(ordering=ordering):
+                params = {'fields': 'id', 'ordering': ordering}
+                with CaptureQueriesContext(connection) as numbered:
+                    self.client.get('/api/products/', params)
+                cache.clear()
+                with CaptureQueriesContext(connection) as keyset:
+                    body = self.client.get('/api/products/', {**params, 'pagination': 'cursor'}).json()
+                # Page number mode also runs a COUNT(*); keyset mode reads
+                # the cursor column with the page instead of per link
+                self.assertEqual(len(keyset), len(numbered) - 1)
+                self.assertEqual(body['results'][0].keys(), {'id'})
+                self.assertIsNotNone(body['next'])
+
+    def test_tampered_cursor_is_not_found(self):
+        cursors = [
+            'not base64!', ['abc', 1, 0], [{'a': 1}, 1, 0], [None, 1, 0],
+            ['2026-01-01T00:00:00+00:00', 'x', 0], ['2026-01-01T00:00:00+00:00', 10 ** 30, 0],
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                if not isinstance(cursor, str):
+                    cursor = base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+                response = self.client.get('/api/products/', {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+        for cursor in (['abc', 1, 0], [[1], 1, 0]):
+            with self.subTest(ordering='price', cursor=cursor):
+                cursor = base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+                response = self.client.get('/api/products/', {'cursor': cursor, 'ordering': 'price'})
+                self.assertEqual(response.status_code, 404)
+
+    def test_search_pages_follow_relevance(self):
+        params = {'search': 'phone'}
+        ids = self.walk(params)
+        self.assertEqual(len(ids), 45)
+        self.assertEqual(ids, self.numbered(params))
+
+
+class CatalogFilterTests(TestCase):
+    """Product list filters on the stored price and rating and the attribute index"""
+
+    @classmethod
+    def setUpTestData(cls):
+        seller = User.objects.create(username='seller', role='seller', seller_approved=True)
+        products = {}
+        for title, price, discount_price, rating_sum, specifications in (
+            ('Cheap', 20, None, 2, {'RAM': '4GB', 'Color': 'Black'}),
+            ('Discounted', 200, 40, 4, {'RAM': '8GB', 'Color': 'Black'}),
+            ('Premium', 300, None, 5, {'RAM': '8GB', 'Color': 'Silver'}),
+        ):
+            products[title] = Product.objects.create(
+                seller=seller, title=title, description='', price=price,
+                discount_price=discount_price, specifications=specifications, is_approved=True,
+            )
+            Product.objects.filter(pk=products[title].pk).update(rating_sum=rating_sum, rating_count=1)
+        Product.objects.update(**Product.ranking_expressions())
+        cls.products = products
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def titles(self, **params):
+        response = self.client.get('/api/products/', {**params, 'ordering': 'title'})
+        self.assertEqual(response.status_code, 200)
+        return [product['title'] for product in response.json()['results']]
+
+    def test_min_rating(self):
+        self.assertEqual(self.titles(min_rating='4'), ['Discounted', 'Premium'])
+        self.assertEqual(self.titles(min_rating='4.5'), ['Premium'])
+
+    def test_price_range_uses_the_price_paid(self):
+        self.assertEqual(self.titles(max_price='50'), ['Cheap', 'Discounted'])
+        self.assertEqual(self.titles(min_price='30.5', max_price='300'), ['Discounted', 'Premium'])
+
+    def test_spec_filters(self):
+        self.assertEqual(self.titles(**{'spec.RAM': '8GB'}), ['Discounted', 'Premium'])
+        # Values of one key are alternatives, different keys must all match
+        self.assertEqual(self.titles(**{'spec.RAM': ['4GB', '8GB']}), ['Cheap', 'Discounted', 'Premium'])
+        self.assertEqual(self.titles(**{'spec.RAM': '8GB', 'spec.Color': 'Black'}), ['Discounted'])
+        self.assertEqual(self.titles(**{'spec.Storage': '1TB'}), [])
+        self.assertEqual(self.titles(**{'spec.RAM': ''}), ['Cheap', 'Discounted', 'Premium'])
+
+    def test_spec_filters_follow_edits(self):
+        product = self.products['Cheap']
+        product.specifications = {'RAM': '8GB'}
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(self.titles(**{'spec.RAM': '8GB'}), ['Cheap', 'Discounted', 'Premium'])
+        self.assertEqual(self.titles(**{'spec.Color': 'Black'}), ['Discounted'])
+
+    def test_malformed_numbers_are_rejected(self):
+        for params in (
+            {'min_rating': 'abc'}, {'min_rating': 'nan'}, {'min_rating': '1e999'},
+            {'min_price': 'abc'}, {'max_price': 'NaN'}, {'max_price': 'sNaN'}, {'max_price': 'Infinity'},
+        ):
+            with self.subTest(**params):
+                response = self.client.get('/api/products/', params)
+                self.assertEqual(response.status_code, 400)
+                name = next(iter(params))
+                self.assertEqual(response.json(), {name: f'{name} must be a number'})
+
+
+class SparseFieldsTests(TestCase):
+    """`?fields=` prunes the rendered fields and rejects unknown names"""
+
+    @classmethod
+    def setUpTestData(cls):
+        seller = User.objects.create(username='seller', role='seller', seller_approved=True)
+        cls.product = Product.objects.create(
+            seller=seller, title='Phone', description='A phone', price=100, is_approved=True,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_requested_fields_are_rendered(self):
+        response = self.client.get('/api/products/', {'fields': 'id,title'})
+        self.assertEqual(response.json()['results'], [{'id': self.product.pk, 'title': 'Phone'}])
+        response = self.client.get(f'/api/products/{self.product.pk}/', {'fields': 'title'})
+        self.assertEqual(response.json(), {'title': 'Phone'})
+
+    def test_unknown_fields_are_rejected(self):
+        for url in ('/api/products/', f'/api/products/{self.product.pk}/'):
+            with self.subTest(url=url):
+                response = self.client.get(url, {'fields': 'id,titel,prise'})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'fields': 'Unknown fields: prise, titel'})
+
+
+class RendererTests(TestCase):
+    """orjson and MessagePack output carry the same values as DRF's JSONRenderer"""
+
+    data = {
+        'price': Decimal('19.90'),
+        'created_at': datetime(2026, 3, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+        'day': date(2026, 3, 1),
+        'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'label': gettext_lazy('Price'),
+        'nested': [{'amount': Decimal('0.5'), 'at': time(9, 15)}],
+        'separator': 'a\u2028b',
+    }
+
+    def test_fast_json_matches_json_renderer(self):
+        fast = FastJSONRenderer().render(self.data)
+        expected = JSONRenderer().render(self.data)
+        self.assertEqual(json.loads(fast), json.loads(expected))
+        self.assertNotIn('\u2028'.encode(), fast)
+
+    def test_msgpack_is_negotiated_and_round_trips(self):
+        seller = User.objects.create(username='seller', role='seller', seller_approved=True)
+        Product.objects.create(seller=seller, title='Phone', description='', price=Decimal('9.99'), is_approved=True)
+        client = APIClient()
+        expected = client.get('/api/products/').json()
+
+        response = client.get('/api/products/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), expected)
+        self.assertEqual(
+            msgpack.unpackb(MessagePackRenderer().render(self.data)),
+            json.loads(JSONRenderer().render(self.data)),
+        )
+
+
+class CompressionTests(TestCase):
+    """API responses are compressed as negotiated; pages are not"""
+
+    @classmethod
+    def setUpTestData(cls):
+        seller = User.objects.create(username='seller', role='seller', seller_approved=True)
+        for i in range(20):
+            Product.objects.create(
+                seller=seller, title=f'Phone {i}', description='A phone with a long description ' * 5,
+                price=100, is_approved=True,
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def get(self, url='/api/products/', params=None, **headers):
+        return self.client.get(url, params, **{f'HTTP_{name.upper()}': value for name, value in headers.items()})
+
+    def test_accept_encoding_negotiation(self):
+        expected = self.get().json()
+        cases = {
+            'gzip, br': 'br',
+            'gzip;q=1.0, br;q=0.5': 'gzip',
+            '*': 'br',
+            'br;q=0, *;q=0.1': 'gzip',
+            'identity': None,
+        }
+        for header, encoding in cases.items():
+            with self.subTest(header):
+                response = self.get(accept_encoding=header)
+                self.assertEqual(response.get('Content-Encoding'), encoding)
+                self.assertIn('Accept-Encoding', response['Vary'])
+                content = response.content
+                if encoding == 'br':
+                    content = brotli.decompress(content)
+                elif encoding == 'gzip':
+                    content = gzip.decompress(content)
+                self.assertEqual(int(response['Content-Length']), len(response.content))
+                self.assertEqual(json.loads(content), expected)
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.get(params={'fields': 'id', 'search': 'tablet'}, accept_encoding='gzip')
+        self.assertLess(len(response.content), settings.COMPRESSION_MIN_SIZE)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_pages_are_not_compressed(self):
+        response = self.get('/admin/login/', accept_encoding='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(len(response.content), settings.COMPRESSION_MIN_SIZE)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_etag_is_weakened_and_still_matches(self):
+        strong = self.get()['ETag']
+        response = self.get(accept_encoding='gzip')
+        self.assertEqual(response['ETag'], f'W/{strong}')
+
+        response = self.get(accept_encoding='gzip', if_none_match=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(response.content)
+
+
+class BatchLookupTests(TestCase):
+    """Products by id in the requested order, skipping ids that do not resolve"""
+
+    @classmethod
+    def setUpTestData(cls):
+        seller = User.objects.create(username='seller', role='seller', seller_approved=True)
+        cls.products = [
+            Product.objects.create(seller=seller, title=f'Phone {i}', description='', price=10, is_approved=True)
+            for i in range(3)
+        ]
+        cls.pending = Product.objects.create(seller=seller, title='Pending', description='', price=10)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.json()]
+
+    def test_requested_order_and_missing_ids(self):
+        first, second, third = (product.pk for product in self.products)
+        missing = self.pending.pk + 1000
+        response = self.client.get('/api/products/batch/', {'ids': f'{third},{missing},{first},{third}'})
+        self.assertEqual(self.ids(response), [third, first])
+        # Unapproved products are missing to the public too
+        response = self.client.get('/api/products/batch/', {'ids': [second, self.pending.pk]})
+        self.assertEqual(self.ids(response), [second])
+
+    def test_post_for_long_lists(self):
+        ids = [product.pk for product in reversed(self.products)]
+        response = self.client.post('/api/products/batch/', {'ids': ids}, format='json')
+        self.assertEqual(self.ids(response), ids)
+
+    def test_id_cap(self):
+        found = [product.pk for product in self.products]
+        missing = range(self.pending.pk + 1, self.pending.pk + 1 + BATCH_MAX_IDS - len(found))
+        ids = [*found, *missing]
+        response = self.client.get('/api/products/batch/', {'ids': ','.join(map(str, ids))})
+        self.assertEqual(self.ids(response), found)
+
+        response = self.client.post('/api/products/batch/', {'ids': [*ids, 0]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': f'At most {BATCH_MAX_IDS} ids can be requested at once'})
+
+    def test_malformed_ids(self):
+        response = self.client.get('/api/products/batch/', {'ids': '1,two'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RatingSummaryTests(TestCase):
+    """Stored rating counters follow reviews and survive saves of stale instances"""
+
+    @classmethod
+    def setUpTestData(cls):
+        seller = User.objects.create(username='seller', role='seller', seller_approved=True)
+        cls.buyers = [User.objects.create(username=f'buyer{i}', role='buyer') for i in range(2)]
+        cls.product = Product.objects.create(
+            seller=seller, title='Phone', description='A phone', price=100, is_approved=True,
+        )
+
+    def review(self, buyer, rating):
+        client = APIClient()
+        client.force_authenticate(buyer)
+        response = client.post('/api/reviews/', {'product': self.product.pk, 'rating': rating, 'comment': 'Fine'})
+        self.assertEqual(response.status_code, 201)
+        return client, response.json()['id']
+
+    def assertSummary(self, rating_sum, rating_count, average_rating, **histogram):
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.rating_sum, product.rating_count), (rating_sum, rating_count))
+        self.assertAlmostEqual(product.average_rating, average_rating)
+        self.assertEqual(product.popularity_score, product.units_sold + rating_count)
+        expected = {str(stars): histogram.get(f'rating_{stars}', 0) for stars in range(1, 6)}
+        self.assertEqual(product.rating_histogram, expected)
+
+    def test_reviews_maintain_summary(self):
+        client, review_id = self.review(self.buyers[0], 5)
+        self.review(self.buyers[1], 2)
+        self.assertSummary(7, 2, 3.5, rating_5=1, rating_2=1)
+
+        client.patch(f'/api/reviews/{review_id}/', {'rating': 4})
+        self.assertSummary(6, 2, 3.0, rating_4=1, rating_2=1)
+
+        client.delete(f'/api/reviews/{review_id}/')
+        self.assertSummary(2, 1, 2.0, rating_2=1)
+
+    def test_update_removes_the_stored_rating(self):
+        client, review_id = self.review(self.buyers[0], 5)
+        stale = Review.objects.get(pk=review_id)
+        client.patch(f'/api/reviews/{review_id}/', {'rating': 4})
+
+        # A concurrent edit that loaded the review before the one above
+        request = mock.Mock(user=self.buyers[0])
+        serializer = ReviewSerializer(stale, data={'rating': 3}, partial=True, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        view = ReviewViewSet(request=request)
+        view.perform_update(serializer)
+        self.assertSummary(3, 1, 3.0, rating_3=1)
+
+    def test_full_save_of_stale_instance_keeps_counters(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        self.review(self.buyers[0], 5)
+        Product.record_sales({self.product.pk: 3})
+
+        stale.title = 'Renamed'
+        stale.save()
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual(product.title, 'Renamed')
+        self.assertEqual((product.rating_count, product.units_sold, product.popularity_score), (1, 3, 4))
+        self.assertSummary(5, 1, 5.0, rating_5=1)
+
+    def test_rebuild_from_reviews(self):
+        self.review(self.buyers[0], 5)
+        self.review(self.buyers[1], 4)
+        Product.objects.filter(pk=self.product.pk).update(
+            **Product.empty_rating_summary(), average_rating=0, popularity_score=0,
+        )
+        self.assertEqual(Product.objects.all().rebuild_rating_summaries(), 1)
+        self.assertSummary(9, 2, 4.5, rating_5=1, rating_4=1)
+
+
+class SlugAllocationTests(TestCase):
+    """Batch slug allocation avoids stored slugs and the rest of the batch"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create(username='seller', role='seller', seller_approved=True)
+        for title in ('Red Phone', 'Red Phone', 'Blue Phone', 'Red Phone Case', 'Red Phone 5G'):
+            Product.objects.create(seller=cls.seller, title=title, price=100)
+
+    def new_products(self, *titles):
+        return [Product(seller=self.seller, title=title, description='', price=100) for title in titles]
+
+    def test_slugs_are_unique_across_batch_and_table(self):
+        products = self.new_products('Red Phone', 'Red Phone', 'Blue Phone', 'Green Phone', 'Green Phone', '!!!')
+        with self.assertNumQueries(1):
+            Product.allocate_slugs(products)
+        self.assertEqual(
+            [product.slug for product in products],
+            ['red-phone-2', 'red-phone-3', 'blue-phone-1', 'green-phone', 'green-phone-1', 'product'],
+        )
+        Product.objects.bulk_create(products)
+        slugs = list(Product.objects.values_list('slug', flat=True))
+        self.assertEqual(len(slugs), len(set(slugs)))
+
+    def test_only_numbered_forms_of_the_base_are_read(self):
+        with CaptureQueriesContext(connection) as queries:
+            Product.allocate_slugs(self.new_products('Red Phone'))
+        with connection.cursor() as cursor:
+            cursor.execute(queries[0]['sql'])
+            self.assertEqual(sorted(row[0] for row in cursor.fetchall()), ['red-phone', 'red-phone-1'])
+
+    def test_one_query_per_batch_of_base_slugs(self):
+        products = self.new_products(*(f'Phone {i}' for i in range(5)))
+        with self.assertNumQueries(3):
+            Product.allocate_slugs(products, batch_size=2)
+        self.assertEqual([product.slug for product in products], [f'phone-{i}' for i in range(5)])
+
+    def test_existing_slugs_are_kept(self):
+        products = self.new_products('Red Phone', 'Red Phone')
+        products[0].slug = 'custom'
+        Product.allocate_slugs(products)
+        self.assertEqual([product.slug for product in products], ['custom', 'red-phone-2'])
+
+
+class OrderStatusTests(TestCase):
+    """Status changes move an order's units in and out of units sold exactly once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create(username='seller', role='seller', seller_approved=True)
+        buyer = User.objects.create(username='buyer', role='buyer')
+        cls.product = Product.objects.create(
+            seller=cls.seller, title='Phone', description='', price=10, is_approved=True,
+        )
+        cls.order = Order.objects.create(
+            buyer=buyer, total_amount=30, shipping_address='Address', shipping_phone='555',
+        )
+        OrderItem.objects.create(order=cls.order, product=cls.product, seller=cls.seller, quantity=3, price=10)
+        Product.record_sales({cls.product.pk: 3})
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.seller)
+
+    def update_status(self, new_status):
+        response = self.client.patch(f'/api/orders/{self.order.pk}/update_status/', {'status': new_status})
+        self.assertEqual(response.status_code, 200)
+
+    def units_sold(self):
+        return Product.objects.get(pk=self.product.pk).units_sold
+
+    def test_cancel_and_reopen(self):
+        self.update_status('cancelled')
+        self.assertEqual(self.units_sold(), 0)
+        self.update_status('confirmed')
+        self.assertEqual(self.units_sold(), 3)
+
+    def test_transition_is_checked_against_the_stored_status(self):
+        Product.record_sales({self.product.pk: 3}, returned=True)
+        Order.objects.filter(pk=self.order.pk).update(status='cancelled')
+        # A concurrent request that loaded the order before it was cancelled
+        stale = Order.objects.get(pk=self.order.pk)
+        stale.status = 'pending'
+        # Units from other orders, which must not be taken back
+        Product.record_sales({self.product.pk: 2})
+        with mock.patch.object(OrderViewSet, 'get_object', return_value=stale):
+            self.update_status('refunded')
+        self.assertEqual(self.units_sold(), 2)
+
+
+@skipUnless(recommendations, 'recommendations need numpy and scipy')
+class RecommendationTests(TestCase):
+    """The batch builders of related products"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create(username='seller', role='seller', seller_approved=True)
+        cls.buyer = User.objects.create(username='buyer', role='buyer')
+        cls.category = Category.objects.create(name='Phones')
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        patcher = override_settings(RECOMMENDATIONS_ROOT=root.name)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def create_product(self, title, description='', category=True):
+        return Product.objects.create(
+            seller=self.seller, category=self.category if category else None, title=title,
+            description=description, price=10, is_approved=True,
+        )
+
+    def create_order(self, *products):
+        order = Order.objects.create(
+            buyer=self.buyer, total_amount=10, shipping_address='Address', shipping_phone='555',
+        )
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, seller=self.seller, price=10)
+
+    def related(self, kind):
+        relations = {}
+        for product_id, related_id in ProductRelation.objects.filter(kind=kind).values_list('product', 'related'):
+            relations.setdefault(product_id, []).append(related_id)
+        return relations
+
+    def test_bought_together_ranks_by_share_of_orders(self):
+        phone, case, charger, cable = (self.create_product(title) for title in ('Phone', 'Case', 'Charger', 'Cable'))
+        for _ in range(3):
+            self.create_order(phone, case)
+        self.create_order(phone, charger, charger)
+        self.create_order(cable)
+        call_command('rebuild_recommendations', settle_seconds=0, stdout=io.StringIO())
+
+        self.assertEqual(self.related(recommendations.BOUGHT_TOGETHER), {
+            phone.pk: [case.pk, charger.pk], case.pk: [phone.pk], charger.pk: [phone.pk],
+        })
+        scores = ProductRelation.objects.filter(product=phone).values_list('score', flat=True)
+        self.assertEqual(list(scores), [0.75, 0.25])
+
+    def test_similar_products_skip_uncategorized(self):
+        galaxy = self.create_product('Samsung Galaxy phone', 'Android phone with a large screen')
+        galaxy_case = self.create_product('Samsung Galaxy phone case', 'Case for a large screen phone')
+        nokia = self.create_product('Nokia phone', 'Phone with buttons')
+        loose = self.create_product('Samsung Galaxy phone', 'Android phone with a large screen', category=False)
+        call_command('rebuild_similar_products', stdout=io.StringIO())
+
+        related = self.related(recommendations.SIMILAR)
+        self.assertEqual(related[galaxy.pk], [galaxy_case.pk, nokia.pk])
+        self.assertNotIn(loose.pk, related)
+        self.assertNotIn(loose.pk, {pk for pks in related.values() for pk in pks})
+        self.assertNotIn(loose.pk, recommendations.ProductVectors.load().product_ids)
+
+    def test_empty_catalog(self):
+        out = io.StringIO()
+        call_command('rebuild_recommendations', settle_seconds=0, stdout=out)
+        call_command('rebuild_similar_products', stdout=out)
+        self.assertIn('Refreshed 0 products (0 relations)', out.getvalue())
+        self.assertIn('Vectorized 0 products (0 relations)', out.getvalue())
+        self.assertFalse(ProductRelation.objects.exists())
+
+
+class CatalogExportTests(TestCase):
+    """Sellers export their own products, admins every product, others nothing"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create(username='seller', role='seller', seller_approved=True)
+        cls.other = User.objects.create(username='other', role='seller', seller_approved=True)
+        cls.admin = User.objects.create(username='admin', is_staff=True)
+        cls.buyer = User.objects.create(username='buyer', role='buyer')
+        for seller, title in ((cls.seller, 'Phone'), (cls.other, 'Laptop')):
+            Product.objects.create(
+                seller=seller, title=title, description='', price=10,
+                specifications={'RAM': '8GB'}, is_approved=False,
+            )
+
+    def export(self, user, **params):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return client.get('/api/products/export/', params)
+
+    def exported(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_sellers_export_their_own_products(self):
+        rows = self.exported(self.export(self.seller, file_format='jsonl'))
+        self.assertEqual([row['title'] for row in rows], ['Phone'])
+        self.assertEqual(rows[0]['specifications'], {'RAM': '8GB'})
+
+    def test_admins_export_everything(self):
+        rows = self.exported(self.export(self.admin, file_format='jsonl'))
+        self.assertEqual(sorted(row['title'] for row in rows), ['Laptop', 'Phone'])
+
+    def test_csv(self):
+        response = self.export(self.seller)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="catalog.csv"')
+        header, row = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(dict(zip(header, row))['title'], 'Phone')
+
+    def test_others_cannot_export(self):
+        self.assertEqual(self.export(None).status_code, 401)
+        self.assertEqual(self.export(self.buyer).status_code, 403)
+        self.assertEqual(self.export(self.seller, file_format='xml').status_code, 400)
+
+
+class CatalogImportTests(TestCase):
+    """Rows with bad values are reported instead of failing the import"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create(username='seller', role='seller', seller_approved=True)
+
+    def import_rows(self, text, fmt):
+        importer = CatalogImporter(self.seller)
+        return importer.run(read_rows(io.StringIO(text, newline=''), fmt))
+
+    def test_wrong_json_types_are_row_errors(self):
+        rows = [
+            {'title': 123, 'price': '10'},
+            {'title': 'Phone', 'price': '10', 'images': 5},
+            {'title': 'Phone', 'price': [10]},
+            {'title': 'Phone', 'price': '10', 'stock': {'a': 1}},
+            {'title': 'Phone', 'price': '10', 'category': ['Phones']},
+            {'title': 'Phone', 'price': '10', 'description': 5},
+            {'title': 'Phone', 'price': '10', 'images': ['a.jpg']},
+        ]
+        report = self.import_rows('\n'.join(json.dumps(row) for row in rows), 'jsonl')
+        self.assertEqual(report.created, 1)
+        self.assertEqual([error['row'] for error in report.errors], [1, 2, 3, 4, 5, 6])
+
+    def test_csv_with_byte_order_mark(self):
+        client = APIClient()
+        client.force_authenticate(self.seller)
+        upload = io.BytesIO('\ufefftitle,price\nPhone,10\n'.encode('utf-8'))
+        upload.name = 'catalog.csv'
+        response = client.post('/api/products/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 1)
+
+
+class CategoryTreeTests(TestCase):
+    """The cached category tree follows committed category changes"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_tree_read_during_save_is_dropped_on_commit(self):
+        def read_tree(**kwargs):
+            get_category_tree()
+
+        # A concurrent read right after the insert, before the path is written
+        post_save.connect(read_tree, sender=Category)
+        self.addCleanup(post_save.disconnect, read_tree, sender=Category)
+        with self.captureOnCommitCallbacks(execute=True):
+            phones = Category.objects.create(name='Phones')
+        with self.captureOnCommitCallbacks(execute=True):
+            android = Category.objects.create(name='Android', parent=phones)
+        with self.captureOnCommitCallbacks(execute=True):
+            books = Category.objects.create(name='Books')
+
+        tree = get_category_tree()
+        self.assertEqual(tree.by_slug['books'].path, f'{books.pk}/')
+        self.assertEqual(tree.subtree_ids('books'), [books.pk])
+        self.assertEqual(set(tree.subtree_ids('phones')), {phones.pk, android.pk})
+        self.assertEqual(tree.subtree_ids('android'), [android.pk])
+
+    def test_moving_a_category_moves_its_subtree(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            phones = Category.objects.create(name='Phones')
+            android = Category.objects.create(name='Android', parent=phones)
+            pixel = Category.objects.create(name='Pixel', parent=android)
+            books = Category.objects.create(name='Books')
+        get_category_tree()
+
+        android.parent = books
+        with self.captureOnCommitCallbacks(execute=True):
+            android.save()
+        pixel.refresh_from_db()
+        self.assertEqual(pixel.path, f'{books.pk}/{android.pk}/{pixel.pk}/')
+        self.assertEqual(set(get_category_tree().subtree_ids('books')), {books.pk, android.pk, pixel.pk})
+
+
+class SuggestIndexTests(TestCase):
+    """Each process's typeahead index picks up changes made elsewhere"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create(username='seller', role='seller', seller_approved=True)
+
+    def setUp(self):
+        cache.clear()
+        suggest._index = None
+        suggest._rebuilding = False
+        self.addCleanup(setattr, suggest, '_index', None)
+        self.addCleanup(setattr, suggest, '_rebuilding', False)
+        self.now = 1000.0
+        patcher = mock.patch.object(suggest.time, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Background rebuilds are run by the tests themselves, on the test
+        # database connection
+        patcher = mock.patch.object(suggest, 'start_rebuild')
+        self.start_rebuild = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def suggested_titles(self, query):
+        return [suggestion['text'] for suggestion in suggest.get_suggest_index().suggest(query)]
+
+    def create_product(self, title):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(
+                seller=self.seller, title=title, description='', price=1, is_approved=True
+            )
+
+    @override_settings(CATALOG_CACHE_SHARED=False)
+    def test_per_process_cache_rebuilds_periodically(self):
+        self.assertEqual(self.suggested_titles('pho'), [])
+        # Written by another process: bulk_create sends no signals here
+        Product.objects.bulk_create([Product(
+            seller=self.seller, title='Phone', slug='phone', description='', price=1, is_approved=True
+        )])
+
+        self.now += suggest.REBUILD_INTERVAL
+        self.assertEqual(self.suggested_titles('pho'), [])
+        self.start_rebuild.assert_not_called()
+
+        # The stale index keeps serving while one rebuild runs
+        self.now += suggest.MAX_INDEX_AGE
+        with mock.patch.object(suggest.SuggestIndex, 'build') as build:
+            self.assertEqual(self.suggested_titles('pho'), [])
+            self.now += suggest.VERSION_CHECK_INTERVAL
+            self.assertEqual(self.suggested_titles('pho'), [])
+        build.assert_not_called()
+        self.start_rebuild.assert_called_once()
+
+        suggest.rebuild_index(*self.start_rebuild.call_args.args)
+        self.assertEqual(self.suggested_titles('pho'), ['Phone'])
+
+    def test_changes_during_rebuild_are_replayed(self):
+        product = self.create_product('Phone')
+        self.assertEqual(self.suggested_titles('pho'), ['Phone'])
+        # Read before the product is renamed
+        built = suggest.SuggestIndex.build()
+
+        self.now += suggest.MAX_INDEX_AGE
+        suggest.get_suggest_index()
+        product.title = 'Phone case'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        with mock.patch.object(suggest.SuggestIndex, 'build', return_value=built):
+            suggest.rebuild_index(*self.start_rebuild.call_args.args)
+        self.assertIs(suggest.get_suggest_index(), built)
+        self.assertEqual(self.suggested_titles('pho'), ['Phone case'])
+
+    def test_changes_apply_on_commit(self):
+        product = self.create_product('Phone')
+        self.assertEqual(self.suggested_titles('pho'), ['Phone'])
+
+        product.title = 'Tablet'
+        with self.captureOnCommitCallbacks() as callbacks:
+            product.save()
+        self.assertEqual(self.suggested_titles('pho'), ['Phone'])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.suggested_titles('pho'), [])
+        self.assertEqual(self.suggested_titles('tab'), ['Tablet'])
+
+
+class SearchIndexTests(TestCase):
+    """Full-text and fuzzy search, and the indexes following product writes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = User.objects.create(username='seller', role='seller', seller_approved=True)
+
+    def search(self, **params):
+        cache.clear()
+        results = APIClient().get('/api/products/', params).json()['results']
+        return [result['title'] for result in results]
+
+    def test_fuzzy_search_tolerates_typos(self):
+        for title in ('Samsung Galaxy phone', 'Teléfono Android', 'Laptop stand'):
+            Product.objects.create(seller=self.seller, title=title, description='', price=10, is_approved=True)
+
+        self.assertEqual(self.search(search='galxy'), [])
+        self.assertEqual(self.search(search='galxy', fuzzy='1'), ['Samsung Galaxy phone'])
+        self.assertEqual(self.search(search='samsng galaxy', fuzzy='true'), ['Samsung Galaxy phone'])
+        # Folded, so accents are optional
+        self.assertEqual(self.search(search='telefno', fuzzy='1'), ['Teléfono Android'])
+        self.assertEqual(self.search(search='xyzzy', fuzzy='1'), [])
+
+    def test_substring_fallback_without_search_backend(self):
+        Product.objects.create(seller=self.seller, title='Teléfono Android', description='', price=10, is_approved=True)
+        with mock.patch('amazon_clone.search.get_search_backend', return_value=None):
+            self.assertEqual(self.search(search='TELEFONO andro'), ['Teléfono Android'])
+
+    def test_only_indexed_fields_reindex(self):
+        product = Product.objects.create(
+            seller=self.seller, title='Phone', description='Android', price=10, is_approved=True
+        )
+        with mock.patch('amazon_clone.signals.index_products') as index_products:
+            product.stock = 5
+            product.save(update_fields=['stock'])
+            index_products.assert_not_called()
+
+            product.description = 'iOS'
+            product.save(update_fields=['description'])
+            index_products.assert_called_once_with([product])
+
+        product.title = 'Tablet'
+        product.save(update_fields=['title'])
+        results = APIClient().get('/api/products/', {'search': 'tablet'}).json()['results']
+        self.assertEqual([result['id'] for result in results], [product.pk])
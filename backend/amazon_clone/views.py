@@ -1,16 +1,35 @@
-from rest_framework import viewsets, status, filters
+import io
+import math
+from decimal import Decimal
+
+from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAuthenticatedOrReadOnly, IsAdminUser
 from rest_framework.authtoken.models import Token
+from django.conf import settings
 from django.shortcuts import get_object_or_404
+from django.http import StreamingHttpResponse
+from django.core.cache import cache
+from django.db import transaction
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q
+from django.db.models import Q, Count
 
 from .models import (
-    User, Category, Product, ProductImage, Order, OrderItem,
-    Review, Wishlist, Cart, CartItem
+    User, Category, Product, ProductAttribute, ProductImage, ProductRelation, Order, OrderItem,
+    Review, Wishlist, Cart, CartItem, primary_image_prefetch
+)
+from .cache import CATEGORIES, PRODUCTS, bump_catalog_versions, cached_catalog_response, product_scope
+from .catalog_io import (
+    EXPORT_CONTENT_TYPES, CatalogImporter, CatalogImportError,
+    detect_format, export_rows, read_rows, render_export
 )
+from .categories import CATEGORY_LIST_CACHE_KEY, get_category_tree
+from .filters import CatalogOrderingFilter
+from .pagination import CatalogPagination
+from .search import FullTextSearchFilter
+from .suggest import get_suggest_index
 from .serializers import (
     UserSerializer, RegisterSerializer, LoginSerializer,
     CategorySerializer, ProductListSerializer, ProductDetailSerializer,
@@ -105,17 +124,88 @@ class CategoryViewSet(viewsets.ModelViewSet):
         if self.action in ['list', 'retrieve']:
             return [AllowAny()]
         return [IsAuthenticated()]
+    
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['category_tree'] = get_category_tree()
+        return context
+    
+    def list(self, request, *args, **kwargs):
+        return cached_catalog_response(
+            request, [CATEGORIES], lambda: self.list_categories(request)
+        )
+    
+    def retrieve(self, request, *args, **kwargs):
+        return cached_catalog_response(
+            request, [CATEGORIES], lambda: super(CategoryViewSet, self).retrieve(request, *args, **kwargs)
+        )
+    
+    def list_categories(self, request):
+        """List categories from the cached, pre-rendered category tree"""
+        data = cache.get(CATEGORY_LIST_CACHE_KEY)
+        if data is None:
+            serializer = self.get_serializer(get_category_tree().categories, many=True)
+            data = list(serializer.data)
+            cache.set(CATEGORY_LIST_CACHE_KEY, data, settings.CATALOG_CACHE_TIMEOUT)
+        
+        page = self.paginate_queryset(data)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(data)
 
 
 # Product ViewSet
+# Price ranges reported by the facets endpoint, as [min, max) pairs
+PRICE_FACET_BUCKETS = [
+    (0, 25), (25, 50), (50, 100), (100, 250), (250, 500), (500, 1000), (1000, None),
+]
+
+# Minimum average ratings reported by the facets endpoint ("4 stars & up")
+RATING_FACET_BUCKETS = [4, 3, 2, 1]
+
+# Most common values reported per specification key by the facets endpoint
+SPEC_FACET_VALUES = 20
+
+# Query parameter prefix for specification filters, e.g. ?spec.RAM=8GB
+SPEC_FILTER_PREFIX = 'spec.'
+
+# Most products the batch endpoint returns in one response
+BATCH_MAX_IDS = 200
+
+
+def number_query_param(request, name, parse):
+    """Query parameter `name` parsed with `parse`, None when absent; 400 unless a finite number"""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        number = parse(value)
+        if not math.isfinite(number):
+            raise ValueError(value)
+    except (ValueError, ArithmeticError):
+        raise ValidationError({name: f'{name} must be a number'})
+    return number
+
+
 class ProductViewSet(viewsets.ModelViewSet):
     """ViewSet for Product model"""
     queryset = Product.objects.filter(is_active=True)
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    # FullTextSearchFilter orders by relevance, so it runs after OrderingFilter
+    filter_backends = [DjangoFilterBackend, CatalogOrderingFilter, FullTextSearchFilter]
     filterset_fields = ['category', 'seller', 'is_featured']
     search_fields = ['title', 'description']
-    ordering_fields = ['price', 'created_at', 'title']
+    ordering_fields = [
+        'price', 'discount', 'created_at', 'title', 'rating', 'average_rating',
+        'units_sold', 'popularity',
+    ]
+    ordering_aliases = {
+        'price': 'effective_price',
+        'discount': 'discount_rate',
+        'rating': 'average_rating',
+        'popularity': 'popularity_score',
+    }
     ordering = ['-created_at']
+    pagination_class = CatalogPagination
     
     def get_serializer_class(self):
         if self.action == 'list':
@@ -125,14 +215,14 @@ class ProductViewSet(viewsets.ModelViewSet):
         return ProductDetailSerializer
     
     def get_permissions(self):
-        if self.action in ['list', 'retrieve', 'featured']:
+        if self.action in ['list', 'retrieve', 'featured', 'facets', 'bought_together', 'similar', 'suggest', 'batch']:
             return [AllowAny()]
         elif self.action in ['create']:
             return [IsAuthenticated()]
         return [IsAuthenticated()]
     
     def get_queryset(self):
-        queryset = Product.objects.all()
+        queryset = Product.objects.select_related('seller', 'category')
         user = self.request.user
         
         # If filtering by seller parameter and user is that seller, show all their products
@@ -144,34 +234,53 @@ class ProductViewSet(viewsets.ModelViewSet):
             # Public view or other users - only show approved and active products
             queryset = queryset.filter(is_active=True, is_approved=True)
         
-        # Filter by price range
-        min_price = self.request.query_params.get('min_price')
-        max_price = self.request.query_params.get('max_price')
-        if min_price:
-            queryset = queryset.filter(price__gte=min_price)
-        if max_price:
-            queryset = queryset.filter(price__lte=max_price)
-        
-        # Filter by rating
-        min_rating = self.request.query_params.get('min_rating')
-        if min_rating:
-            # This is a simplified filter; for production, consider using annotations
-            queryset = [p for p in queryset if p.average_rating >= float(min_rating)]
+        # Filter by a category and all of its subcategories, resolved from
+        # the cached category tree so this stays a single indexed query
+        category_tree = self.request.query_params.get('category_tree')
+        if category_tree:
+            queryset = queryset.filter(category_id__in=get_category_tree().subtree_ids(category_tree))
+        
+        # Filter by specification values through the attribute index; values
+        # for the same key are alternatives, different keys must all match
+        for param, values in self.request.query_params.lists():
+            if param.startswith(SPEC_FILTER_PREFIX) and any(values):
+                key = param[len(SPEC_FILTER_PREFIX):]
+                queryset = queryset.filter(pk__in=ProductAttribute.objects.filter(
+                    key=key, value__in=[value for value in values if value]
+                ).values('product_id'))
+        
+        # Filter by the price buyers actually pay
+        min_price = number_query_param(self.request, 'min_price', Decimal)
+        max_price = number_query_param(self.request, 'max_price', Decimal)
+        if min_price is not None:
+            queryset = queryset.filter(effective_price__gte=min_price)
+        if max_price is not None:
+            queryset = queryset.filter(effective_price__lte=max_price)
+        
+        # Filter by the stored average rating
+        min_rating = number_query_param(self.request, 'min_rating', float)
+        if min_rating is not None:
+            queryset = queryset.filter(average_rating__gte=min_rating)
+        
+        # Load only the columns the rendered fields read (`?fields=`)
+        if self.action in ['list', 'retrieve', 'batch']:
+            queryset = self.get_serializer_class().narrow_queryset(queryset, self.request)
         
         return queryset
-        
-    @action(detail=False, methods=['get'])
-    def featured(self, request):
-        """Get featured products"""
-        featured_products = self.get_queryset().filter(is_featured=True, is_active=True)
-        page = self.paginate_queryset(featured_products)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-            
-        serializer = self.get_serializer(featured_products, many=True)
-        return Response(serializer.data)
     
+    def list(self, request, *args, **kwargs):
+        return cached_catalog_response(
+            request, [PRODUCTS], lambda: super(ProductViewSet, self).list(request, *args, **kwargs)
+        )
+    
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs.get('pk')
+        return cached_catalog_response(
+            request, [product_scope(pk), CATEGORIES],
+            lambda: super(ProductViewSet, self).retrieve(request, *args, **kwargs),
+            last_modified=lambda: Product.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+        )
+        
     def perform_create(self, serializer):
         # Ensure user is a seller
         if self.request.user.role != 'seller' or not self.request.user.seller_approved:
@@ -193,10 +302,209 @@ class ProductViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def featured(self, request):
         """Get featured products"""
-        featured = self.queryset.filter(is_featured=True)[:10]
+        return cached_catalog_response(request, [PRODUCTS], lambda: self.list_featured(request))
+    
+    def list_featured(self, request):
+        featured = Product.objects.approved().select_related('seller', 'category').filter(is_featured=True)[:10]
         serializer = ProductListSerializer(featured, many=True, context={'request': request})
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """Counts per category, price range, rating and featured flag for the current filters"""
+        return cached_catalog_response(request, [PRODUCTS], lambda: self.count_facets(request))
+    
+    def count_facets(self, request):
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+
+        aggregates = {
+            'total': Count('id'),
+            'featured': Count('id', filter=Q(is_featured=True)),
+        }
+        for low, high in PRICE_FACET_BUCKETS:
+            condition = Q(effective_price__gte=low)
+            if high is not None:
+                condition &= Q(effective_price__lt=high)
+            aggregates[f'price_{low}'] = Count('id', filter=condition)
+        for stars in RATING_FACET_BUCKETS:
+            aggregates[f'rating_{stars}'] = Count('id', filter=Q(average_rating__gte=stars))
+        counts = queryset.aggregate(**aggregates)
+
+        categories = (
+            queryset.filter(category__isnull=False)
+            .values('category_id', 'category__name', 'category__slug')
+            .annotate(count=Count('id'))
+            .order_by('-count', 'category__name')
+        )
+
+        specifications = {}
+        attributes = (
+            ProductAttribute.objects.filter(product__in=queryset.values('pk'))
+            .values('key', 'value')
+            .annotate(count=Count('product_id'))
+            .order_by('key', '-count', 'value')
+        )
+        for row in attributes:
+            values = specifications.setdefault(row['key'], [])
+            if len(values) < SPEC_FACET_VALUES:
+                values.append({'value': row['value'], 'count': row['count']})
+
+        return Response({
+            'total': counts['total'],
+            'categories': [
+                {
+                    'id': row['category_id'],
+                    'name': row['category__name'],
+                    'slug': row['category__slug'],
+                    'count': row['count'],
+                }
+                for row in categories
+            ],
+            'price': [
+                {'min': low, 'max': high, 'count': counts[f'price_{low}']}
+                for low, high in PRICE_FACET_BUCKETS
+            ],
+            'rating': [
+                {'min_rating': stars, 'count': counts[f'rating_{stars}']}
+                for stars in RATING_FACET_BUCKETS
+            ],
+            'featured': {
+                'true': counts['featured'],
+                'false': counts['total'] - counts['featured'],
+            },
+            'specifications': specifications,
+        })
+    
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """Typeahead suggestions of product titles and categories for `?q=`"""
+        query = request.query_params.get('q', '')
+        return Response(get_suggest_index().suggest(query))
+    
+    @action(detail=False, methods=['get', 'post'])
+    def batch(self, request):
+        """Products for a list of ids in the requested order: `?ids=1,2,3`, or POST `ids` for long lists"""
+        if request.method == 'POST':
+            data = request.data
+            values = data.getlist('ids') if hasattr(data, 'getlist') else data.get('ids', [])
+        else:
+            values = request.query_params.getlist('ids')
+        if isinstance(values, (str, int)):
+            values = [values]
+        
+        ids = []
+        try:
+            for value in values:
+                for part in str(value).split(','):
+                    if part.strip():
+                        ids.append(int(part))
+        except ValueError:
+            return Response(
+                {'error': 'ids must be a comma-separated list of integers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > BATCH_MAX_IDS:
+            return Response(
+                {'error': f'At most {BATCH_MAX_IDS} ids can be requested at once'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return cached_catalog_response(
+            request, [PRODUCTS, CATEGORIES], lambda: self.list_batch(request, ids)
+        )
+    
+    def list_batch(self, request, ids):
+        products = self.get_queryset().filter(pk__in=ids).prefetch_related('images')
+        by_id = {product.pk: product for product in products}
+        products = [by_id[pk] for pk in ids if pk in by_id]
+        serializer = ProductDetailSerializer(products, many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
+    
+    @action(detail=True, methods=['get'], url_path='bought-together')
+    def bought_together(self, request, pk=None):
+        """Products frequently bought together with this one"""
+        return cached_catalog_response(
+            request, [product_scope(pk), PRODUCTS],
+            lambda: self.list_related(request, 'bought_together')
+        )
+    
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """Products of the same category with similar titles, descriptions and specifications"""
+        return cached_catalog_response(
+            request, [product_scope(pk), PRODUCTS],
+            lambda: self.list_related(request, 'similar')
+        )
+    
+    def list_related(self, request, kind):
+        """Serve the precomputed relations of a product in rank order"""
+        product = self.get_object()
+        relations = (
+            ProductRelation.objects.filter(product=product, kind=kind)
+            .filter(related__is_approved=True, related__is_active=True)
+            .select_related('related__seller', 'related__category')
+            .order_by('rank')
+        )
+        products = [relation.related for relation in relations]
+        serializer = ProductListSerializer(products, many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
+    
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_products(self, request):
+        """Bulk import the seller's products from an uploaded CSV or JSONL file"""
+        if request.user.role != 'seller' or not request.user.seller_approved:
+            return Response(
+                {'error': 'Only approved sellers can import products'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response(
+                {'error': 'No file provided'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        fmt = request.data.get('format') or detect_format(upload.name)
+        # utf-8-sig drops the byte order mark spreadsheet exports start with
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        importer = CatalogImporter(request.user)
+        try:
+            report = importer.run(read_rows(stream, fmt))
+        except (CatalogImportError, UnicodeDecodeError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(report.as_dict(), status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['get'], url_path='export')
+    def export_products(self, request):
+        """Stream the catalog as CSV or JSONL: sellers get their own products, admins everything"""
+        if request.user.is_staff:
+            queryset = Product.objects.all()
+        elif request.user.role == 'seller':
+            queryset = Product.objects.filter(seller=request.user)
+        else:
+            return Response(
+                {'error': 'Only sellers and admins can export the catalog'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        # `format` is reserved by DRF for renderer selection
+        fmt = request.query_params.get('file_format', 'csv')
+        if fmt not in EXPORT_CONTENT_TYPES:
+            return Response(
+                {'error': f'Unsupported format: {fmt}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        rows = export_rows(queryset, build_url=request.build_absolute_uri)
+        response = StreamingHttpResponse(
+            render_export(rows, fmt), content_type=EXPORT_CONTENT_TYPES[fmt]
+        )
+        response['Content-Disposition'] = f'attachment; filename="catalog.{fmt}"'
+        return response
+    
     @action(detail=True, methods=['post'])
     def upload_image(self, request, pk=None):
         """Upload product image"""
@@ -238,7 +546,7 @@ class ProductViewSet(viewsets.ModelViewSet):
 # Review ViewSet
 class ReviewViewSet(viewsets.ModelViewSet):
     """ViewSet for Review model"""
-    queryset = Review.objects.all()
+    queryset = Review.objects.select_related('buyer', 'product')
     serializer_class = ReviewSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     
@@ -247,22 +555,39 @@ class ReviewViewSet(viewsets.ModelViewSet):
         product_id = self.request.query_params.get('product')
         if product_id:
             queryset = queryset.filter(product_id=product_id)
+        if self.action in ['list', 'retrieve']:
+            queryset = ReviewSerializer.narrow_queryset(queryset, self.request)
         return queryset
     
     def perform_create(self, serializer):
         if self.request.user.role != 'buyer':
             raise PermissionError("Only buyers can leave reviews")
-        serializer.save(buyer=self.request.user)
+        with transaction.atomic():
+            review = serializer.save(buyer=self.request.user)
+            Product.update_rating_summary(review.product_id, added=review.rating)
     
     def perform_update(self, serializer):
         if serializer.instance.buyer != self.request.user:
             raise PermissionError("You can only update your own reviews")
-        serializer.save()
+        with transaction.atomic():
+            # Lock the review so concurrent edits each remove the rating the
+            # one before them stored, not the same stale one
+            serializer.instance = Review.objects.select_for_update().get(pk=serializer.instance.pk)
+            old_product_id = serializer.instance.product_id
+            old_rating = serializer.instance.rating
+            review = serializer.save()
+            if review.product_id == old_product_id:
+                Product.update_rating_summary(review.product_id, added=review.rating, removed=old_rating)
+            else:
+                Product.update_rating_summary(old_product_id, removed=old_rating)
+                Product.update_rating_summary(review.product_id, added=review.rating)
     
     def perform_destroy(self, instance):
         if instance.buyer != self.request.user:
             raise PermissionError("You can only delete your own reviews")
-        instance.delete()
+        with transaction.atomic():
+            instance.delete()
+            Product.update_rating_summary(instance.product_id, removed=instance.rating)
 
 
 # Order ViewSet
@@ -270,6 +595,7 @@ class OrderViewSet(viewsets.ModelViewSet):
     """ViewSet for Order model"""
     queryset = Order.objects.all()
     permission_classes = [IsAuthenticated]
+    pagination_class = CatalogPagination
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -278,11 +604,20 @@ class OrderViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         user = self.request.user
+        queryset = Order.objects.select_related('buyer')
+        requested = OrderSerializer.requested_fields(self.request)
+        if requested is None or 'items' in requested:
+            queryset = queryset.prefetch_related(
+                'items__product',
+                primary_image_prefetch('items__product__images')
+            )
+        if self.action in ['list', 'retrieve']:
+            queryset = OrderSerializer.narrow_queryset(queryset, self.request)
         if user.role == 'buyer':
-            return Order.objects.filter(buyer=user)
+            return queryset.filter(buyer=user)
         elif user.role == 'seller':
             # Sellers see orders containing their products
-            return Order.objects.filter(items__seller=user).distinct()
+            return queryset.filter(items__seller=user).distinct()
         return Order.objects.none()
     
     def perform_create(self, serializer):
@@ -317,8 +652,19 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        order.status = new_status
-        order.save()
+        # Units of orders that fall through stop counting as sold, and
+        # count again if the order is picked back up. The order is locked
+        # so concurrent updates see each other's status and count it once
+        is_sold = new_status not in Order.UNSOLD_STATUSES
+        with transaction.atomic():
+            order = Order.objects.select_for_update().get(pk=order.pk)
+            was_sold = order.status not in Order.UNSOLD_STATUSES
+            order.status = new_status
+            order.save()
+            if was_sold != is_sold:
+                Product.record_sales(order.item_quantities(), returned=was_sold)
+        if was_sold != is_sold:
+            bump_catalog_versions(PRODUCTS)
         
         serializer = OrderSerializer(order, context={'request': request})
         return Response(serializer.data)
@@ -519,9 +865,10 @@ class AdminViewSet(viewsets.ViewSet):
         ).select_related('seller')
         
         # Add seller name and format the response
+        pending_products = list(pending_products)
+        serialized = ProductListSerializer(pending_products, many=True).data
         products_data = []
-        for product in pending_products:
-            product_data = ProductListSerializer(product).data
+        for product, product_data in zip(pending_products, serialized):
             product_data['seller_name'] = product.seller.get_full_name() or product.seller.username
             product_data['created_at'] = product.created_at
             products_data.append(product_data)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+from importlib.util import find_spec
 from pathlib import Path
 import os
 import dj_database_url
@@ -60,6 +61,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    # Compresses what the middleware below produce, so it sits near the top
+    'amazon_clone.middleware.CompressionMiddleware',
     "django.middleware.common.CommonMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
@@ -168,6 +171,51 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # Custom User Model
 AUTH_USER_MODEL = "amazon_clone.User"
 
+# Cache Configuration
+# For production, set environment variable CACHE_URL to one of:
+#   locmem://                       (default, per process)
+#   file:///var/tmp/bloquesite_cache
+#   redis://127.0.0.1:6379/1       (any Redis-compatible server, needs the redis package)
+CACHE_URL = os.environ.get('CACHE_URL', 'locmem://')
+
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+elif CACHE_URL.startswith('file://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_URL[len('file://'):],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'bloquesite',
+        }
+    }
+
+# Whether all workers share the cache. A per-process cache cannot be
+# invalidated from other workers, so responses are only kept briefly there
+CATALOG_CACHE_SHARED = CACHE_URL.startswith(('redis://', 'rediss://', 'file://'))
+
+# Seconds an anonymous catalog response stays cached; entries are also
+# invalidated as soon as the products or categories they show change
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', 3600 if CATALOG_CACHE_SHARED else 10))
+
+# API response compression (Brotli when the brotli package is installed, else gzip)
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 5))
+
+# Saved state of the recommendation builders (co-purchase matrix, ...)
+RECOMMENDATIONS_ROOT = os.environ.get('RECOMMENDATIONS_ROOT', BASE_DIR / 'recommendations')
+
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -177,6 +225,12 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
+    # orjson-backed JSON by default; MessagePack for `Accept: application/msgpack`
+    'DEFAULT_RENDERER_CLASSES': [
+        'amazon_clone.renderers.FastJSONRenderer',
+        *(['amazon_clone.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
 }